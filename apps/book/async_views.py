@@ -0,0 +1,100 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import Http404
+
+from apps.book.cache import get_validator_versions
+from apps.book.favorites import aget_favorite_ids
+from apps.book.filters import BookFilter
+from apps.book.hydration import ahydrate_books, with_book_relations
+from apps.book.models import Book
+from apps.book.rendering import book_values, render_book
+from apps.book.serializers import BookSerializer
+from apps.book.views import get_top_rated_books, serialize_top_rated
+from apps.review.models import Review
+from apps.review.rendering import review_values, render_review
+from apps.user.models import USERS_UPDATED_KEY
+from config.async_views import AsyncReadView, run_in_thread
+from config.pagination import CreatedAtCursorPagination, EmbeddedReviewPagination, RankedPagination
+
+# Async twins of the hottest BookViewSet reads, same responses and validators.
+# Django runs the ORM queries of a request one after another on its own thread,
+# the redis reads are awaited next to them on pool threads.
+
+
+class AsyncBookListView(AsyncReadView):
+    filterset_class = BookFilter
+    # is_favorited depends on who is asking
+    vary_headers = ('Accept', 'Authorization')
+
+    async def get(self, request):
+        versions, favorite_ids = await asyncio.gather(
+            run_in_thread(get_validator_versions, ('books', 'reviews', 'favorites', 'users')),
+            aget_favorite_ids(request.user),
+        )
+        etag = self.get_etag(request, request.user.pk, *versions.values()) if versions else None
+        not_modified = self.not_modified_response(request, etag)
+        if not_modified:
+            return not_modified
+
+        # Ranked search results have no created_at order for the cursor to walk
+        paginator = RankedPagination() if request.query_params.get('q') else CreatedAtCursorPagination()
+        page = await sync_to_async(self.paginate)(Book.objects.filter(is_active=True), paginator, book_values)
+        results = [render_book(row, favorite_ids) for row in page]
+        return self.set_validators(self.paginated_response(paginator, results), etag)
+
+
+class AsyncBookDetailView(AsyncReadView):
+    vary_headers = ('Accept', 'Authorization')
+
+    async def get(self, request, pk):
+        # The book, the favorite ids and the last user change do not depend on each other, the
+        # reviews are only paged once the book exists and the validators did not match
+        book, favorite_ids, users_updated_at = await asyncio.gather(
+            self.get_book(pk),
+            aget_favorite_ids(request.user),
+            run_in_thread(cache.get, USERS_UPDATED_KEY),
+        )
+
+        stats = getattr(book, 'rating_stats', None)
+        versions = (book.updated_at, stats.updated_at if stats else None, book.favorites_updated_at, users_updated_at)
+        favorite = (book.favorite_count, request.user.pk, book.pk in favorite_ids)
+        etag = self.get_etag(request, book.pk, *versions, *favorite)
+        last_modified = max(version for version in versions if version)
+        not_modified = self.not_modified_response(request, etag, last_modified)
+        if not_modified:
+            return not_modified
+
+        review_paginator = EmbeddedReviewPagination()
+        reviews = await sync_to_async(review_paginator.paginate_queryset)(
+            review_values(Review.objects.filter(book_id=pk)), request, view=self
+        )
+        response_data = BookSerializer(book, context={'request': request, 'favorite_ids': favorite_ids}).data
+        response_data['rating_histogram'] = stats.histogram if stats else None
+        response_data['reviews'] = [render_review(row) for row in reviews]
+        response_data['reviews_next'] = review_paginator.get_next_link()
+        return self.set_validators(self.json_response(response_data), etag, last_modified)
+
+    async def get_book(self, pk):
+        try:
+            return await with_book_relations(Book.objects.filter(is_active=True)).aget(pk=pk)
+        except Book.DoesNotExist:
+            raise Http404
+
+
+class AsyncTopRatedView(AsyncReadView):
+
+    async def get(self, request):
+        # A cold ranking is filled from the database, so it runs on the ORM thread
+        top_rated_books, favorite_ids = await asyncio.gather(
+            sync_to_async(get_top_rated_books)(),
+            aget_favorite_ids(request.user),
+        )
+        if not top_rated_books:
+            return self.json_response({"detail": "No reviews found."}, status=404)
+
+        average_ratings = {book_info['book']: book_info['avg_rating'] for book_info in top_rated_books}
+        books = await ahydrate_books(list(average_ratings))
+        context = {'request': request, 'favorite_ids': favorite_ids}
+        return self.json_response(serialize_top_rated(books, average_ratings, context))
@@ -0,0 +1,198 @@
+import json
+import unicodedata
+
+from django_redis import get_redis_connection
+
+# Each field is a sorted set with every member at score 0, so redis orders
+# them lexicographically and ZRANGEBYLEX walks a prefix in O(log n + k).
+# Title members are "<normalized text>\0<book id>\0<title>", one set per book.
+# Author members are "<normalized text>\0<normalized name>", one set per
+# distinct author however many books they wrote, counted in AUTHOR_REFS_KEY
+# and displayed with the spelling kept in AUTHOR_NAMES_KEY.
+AUTOCOMPLETE_FIELDS = ('title', 'author')
+MAX_WORDS_INDEXED = 5
+SEPARATOR = '\0'
+REBUILD_BATCH_SIZE = 500
+
+TITLE_INDEX_KEY = 'autocomplete:title'
+AUTHOR_INDEX_KEY = 'autocomplete:author'
+AUTHOR_NAMES_KEY = 'autocomplete:author:names'
+AUTHOR_REFS_KEY = 'autocomplete:author:refs'
+# Entries indexed for each book, so an update can remove them without reading the old row
+BOOKS_KEY = 'autocomplete:books'
+INDEX_KEYS = (TITLE_INDEX_KEY, AUTHOR_INDEX_KEY, AUTHOR_NAMES_KEY, AUTHOR_REFS_KEY, BOOKS_KEY)
+
+# Replaces the entries of books in one atomic step, ARGV holds book id and
+# entry pairs, an empty entry removes the book. Author members are added by
+# the first book of an author and removed with the last one.
+INDEX_BOOKS_SCRIPT = """
+local function remove_author(author)
+    if redis.call('HINCRBY', KEYS[4], author.name, -1) <= 0 then
+        redis.call('HDEL', KEYS[4], author.name)
+        redis.call('HDEL', KEYS[3], author.name)
+        redis.call('ZREM', KEYS[2], unpack(author.members))
+    end
+end
+
+for i = 1, #ARGV, 2 do
+    local old = redis.call('HGET', KEYS[5], ARGV[i])
+    if old then
+        old = cjson.decode(old)
+        if #old.title > 0 then
+            redis.call('ZREM', KEYS[1], unpack(old.title))
+        end
+        if old.author then
+            remove_author(old.author)
+        end
+    end
+    if ARGV[i + 1] == '' then
+        redis.call('HDEL', KEYS[5], ARGV[i])
+    else
+        local new = cjson.decode(ARGV[i + 1])
+        for _, member in ipairs(new.title) do
+            redis.call('ZADD', KEYS[1], 0, member)
+        end
+        if new.author then
+            if redis.call('HINCRBY', KEYS[4], new.author.name, 1) == 1 then
+                for _, member in ipairs(new.author.members) do
+                    redis.call('ZADD', KEYS[2], 0, member)
+                end
+            end
+            redis.call('HSETNX', KEYS[3], new.author.name, new.author.display)
+        end
+        redis.call('HSET', KEYS[5], ARGV[i], ARGV[i + 1])
+    end
+end
+"""
+
+_index_books_script = None
+
+
+def _get_index_script():
+    global _index_books_script
+    if _index_books_script is None:
+        _index_books_script = get_redis_connection('default').register_script(INDEX_BOOKS_SCRIPT)
+    return _index_books_script
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.casefold().split())
+
+
+def _word_starts(normalized):
+    # Also complete from the start of the first words, "hob" finds "The Hobbit"
+    words = normalized.split(' ')
+    return [' '.join(words[start:]) for start in range(min(len(words), MAX_WORDS_INDEXED)) if words[start]]
+
+
+def _entry(book):
+    # What an active book puts in the index, None for an inactive one
+    if not book.is_active:
+        return None
+    entry = {
+        'title': [SEPARATOR.join((text, str(book.id), book.title)) for text in _word_starts(normalize(book.title))],
+    }
+    author = normalize(book.author)
+    if author:
+        entry['author'] = {
+            'name': author,
+            'display': book.author,
+            'members': [SEPARATOR.join((text, author)) for text in _word_starts(author)],
+        }
+    return entry
+
+
+def index_book(book):
+    """
+    Replace the entries of a book, or only remove them when it is no longer active.
+    """
+    index_books([book])
+
+
+def index_books(books, keys=INDEX_KEYS):
+    """
+    Replace the entries of several books in one round trip.
+    """
+    args = []
+    for book in books:
+        entry = _entry(book)
+        args += [book.id, json.dumps(entry) if entry else '']
+    if args:
+        _get_index_script()(keys=list(keys), args=args)
+
+
+def remove_book(book):
+    book.is_active = False
+    index_book(book)
+
+
+def rebuild(books):
+    """
+    Fill a new index from the given books and swap it in at once, completions
+    keep coming from the old index meanwhile. Edits committed during the
+    rebuild to books it already read are only in the old index.
+    """
+    connection = get_redis_connection('default')
+    build_keys = [f'{key}:rebuild' for key in INDEX_KEYS]
+    connection.delete(*build_keys)
+
+    count, batch = 0, []
+    for book in books:
+        batch.append(book)
+        if len(batch) == REBUILD_BATCH_SIZE:
+            index_books(batch, build_keys)
+            count, batch = count + len(batch), []
+    index_books(batch, build_keys)
+    count += len(batch)
+
+    built = [connection.exists(key) for key in build_keys]
+    pipeline = connection.pipeline(transaction=True)
+    for key, build_key, exists in zip(INDEX_KEYS, build_keys, built):
+        if exists:
+            pipeline.rename(build_key, key)
+        else:
+            pipeline.delete(key)
+    pipeline.execute()
+    # Per book keys of the earlier layout of the index
+    stale_keys = list(connection.scan_iter('autocomplete:book:*'))
+    if stale_keys:
+        connection.delete(*stale_keys)
+    return count
+
+
+def complete(field, prefix, limit=10):
+    """
+    Return up to limit completions of prefix in lexicographic order, one per book for
+    titles and one per distinct name for authors.
+    """
+    prefix = normalize(prefix)
+    if not prefix:
+        return []
+    connection = get_redis_connection('default')
+    # A book or an author can match from several of its words, read ahead to fill the page after deduplication
+    members = connection.zrangebylex(
+        TITLE_INDEX_KEY if field == 'title' else AUTHOR_INDEX_KEY,
+        b'[' + prefix.encode(),
+        b'[' + prefix.encode() + b'\xff',
+        start=0,
+        num=limit * MAX_WORDS_INDEXED,
+    )
+
+    if field == 'author':
+        names = list(dict.fromkeys(member.decode().split(SEPARATOR, 1)[1] for member in members))[:limit]
+        if not names:
+            return []
+        return [{'author': display.decode()} for display in connection.hmget(AUTHOR_NAMES_KEY, names) if display]
+
+    results, seen = [], set()
+    for member in members:
+        _, book_id, title = member.decode().split(SEPARATOR, 2)
+        if book_id in seen:
+            continue
+        seen.add(book_id)
+        results.append({'id': int(book_id), 'title': title})
+        if len(results) == limit:
+            break
+    return results
@@ -1,19 +1,274 @@
+import math
+import random
+import secrets
+import time
+
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from config.cache import CacheStats, LocalCache
+from config.db_router import reads_from_replica, use_primary
+
+# Size and lifetime of the in-process tier in front of redis
+LOCAL_CACHE_SIZE = getattr(settings, 'LOCAL_CACHE_SIZE', 256)
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'LOCAL_CACHE_TIMEOUT', 5)
+# How long the fill lock is held at most and how long a miss waits for it
+FILL_LOCK_TIMEOUT = 30
+FILL_LOCK_WAIT = 5
+FILL_LOCK_POLL = 0.05
+
+# Deletes a lock only while it still holds the token of its owner
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_release_lock_script = None
+
+
+local_cache = LocalCache(maxsize=LOCAL_CACHE_SIZE, timeout=LOCAL_CACHE_TIMEOUT)
+stats = CacheStats()
+
+
+def get_cache_stats():
+    return stats.snapshot()
+
+
+def get_or_fill(key, fill, timeout, stale_timeout=None, beta=1.0, tags=()):
+    """
+    Return the cached value of key, calling fill() to compute it when needed.
+
+    Values are stored in an envelope with their expiry and the time the fill
+    took. Readers refresh a value early with a probability that grows as the
+    expiry gets closer and the fill gets slower, and once it expired the value
+    is still served for stale_timeout seconds while a single worker holding
+    the fill lock recomputes it. On a cold miss only the lock holder runs
+    fill(), the other workers wait for its result.
 
-def book__cache(cache_key, queryset, timeout=100):
-    if cache_key in cache:
-        return cache.get(cache_key)
+    An entry built with tags is dropped as soon as one of its tags is
+    invalidated. Entries in the local tier of other processes are not
+    checked against the tags and may lag for LOCAL_CACHE_TIMEOUT seconds.
+    """
+    if stale_timeout is None:
+        stale_timeout = timeout
+
+    envelope = local_cache.get(key)
+    if envelope is not None:
+        stats.incr('local_hits')
     else:
-        queryset = queryset()
-        cache.set(cache_key, list(queryset), timeout=timeout)
-        return queryset
-    
-def top_book_cache(cache_key,queryset_fun,timeout=60*60*2):
-    if cache_key in cache:
-        return cache.get(cache_key)
-    queryset=queryset_fun()
-    cache.set(cache_key,list(queryset),timeout=timeout)
-    return queryset
+        envelope = _get_shared(key, tags)
+
+    if envelope is None:
+        stats.incr('misses')
+        return _fill_on_miss(key, fill, timeout, stale_timeout, tags)
+
+    if not _should_refresh(envelope, beta):
+        stats.incr('hits')
+        return envelope['value']
+
+    # Stale or picked for an early refresh, the other workers keep serving the old value
+    stats.incr('stale_hits')
+    lock = _acquire_fill_lock(key)
+    if lock:
+        try:
+            return _fill(key, fill, timeout, stale_timeout, tags)
+        finally:
+            _release_fill_lock(key, lock)
+    return envelope['value']
+
+
+def get_many_or_fill(keys, fill, timeout, tags=lambda key: ()):
+    """
+    Return {key: value} for keys, reading every entry and the versions of
+    their tags with a single MGET. fill(missing_keys) computes the misses in
+    one go and returns {key: value}, they are written back with one pipeline.
+    Keys fill() leaves out are missing from the result and are not cached.
+
+    Unlike get_or_fill there is no local tier, early refresh or fill lock,
+    a concurrent miss on the same key is filled twice.
+    """
+    key_tags = {key: tuple(tags(key)) for key in keys}
+    tag_keys = {_tag_key(tag) for key_tag in key_tags.values() for tag in key_tag}
+    values = cache.get_many(list(keys) + list(tag_keys))
+    versions = get_tag_versions({tag for key_tag in key_tags.values() for tag in key_tag}, values)
+
+    found, missing = {}, []
+    for key in keys:
+        envelope = values.get(key)
+        if envelope is not None and envelope['tags'] == {tag: versions[tag] for tag in key_tags[key]}:
+            found[key] = envelope['value']
+        else:
+            missing.append(key)
+    stats.incr('hits', len(found))
+    if not missing:
+        return found
+
+    stats.incr('misses', len(missing))
+    # Versions were read before the fill, an invalidation racing with it leaves the entries outdated
+    start = time.monotonic()
+    with use_primary():
+        filled = fill(missing)
+    delta = time.monotonic() - start
+    stats.incr('fills')
+    stats.incr('fill_seconds', delta)
+
+    expires = time.time() + timeout
+    cache.set_many({
+        key: {
+            'value': value,
+            'expires': expires,
+            'delta': delta,
+            'tags': {tag: versions[tag] for tag in key_tags[key]},
+        }
+        for key, value in filled.items()
+    }, timeout=timeout)
+    found.update(filled)
+    return found
+
+
+def delete(key):
+    local_cache.delete(key)
+    cache.delete(key)
+
+
+def invalidate_tags(*tags):
+    """
+    Bump the version of each tag, every entry built with an older version becomes a miss.
+    """
+    if settings.REPLICA_DATABASES:
+        # Marked before the bump, a reader that sees the new version sees the mark too
+        cache.set_many({_recent_key(tag): 1 for tag in tags}, timeout=settings.REPLICA_STICKY_SECONDS)
+    for tag in tags:
+        try:
+            cache.incr(_tag_key(tag))
+        except ValueError:
+            # Unknown or evicted tag, a new timestamp based version can never match an old one
+            cache.set(_tag_key(tag), time.time_ns(), timeout=None)
+    stats.incr('invalidations', len(tags))
+    local_cache.delete_tagged(set(tags))
+
+
+def invalidate_tags_on_commit(*tags):
+    # Invalidating before the commit would let a reader refill the entry from the old rows
+    transaction.on_commit(lambda: invalidate_tags(*tags))
+
+
+def _tag_key(tag):
+    return f'tag:{tag}'
+
+
+def _recent_key(tag):
+    return f'tag:{tag}:recent'
+
+
+def get_tag_versions(tags, known=None):
+    """
+    Return the current version of each tag, versions already read can be passed as known.
+    """
+    known = dict(known or {})
+    missing = [_tag_key(tag) for tag in tags if _tag_key(tag) not in known]
+    if missing:
+        known.update(cache.get_many(missing))
+        for tag_key in missing:
+            if tag_key not in known:
+                cache.add(tag_key, time.time_ns(), timeout=None)
+                known[tag_key] = cache.get(tag_key)
+    return {tag: known[_tag_key(tag)] for tag in tags}
+
+
+def get_validator_versions(tags):
+    """
+    Return the current versions of tags to derive a validator from, None when
+    the request reads from a replica and one of the tags was bumped in the
+    last REPLICA_STICKY_SECONDS. The replica may not have that write yet, a
+    validator of the new versions would label its old rows as current.
+    """
+    versions = get_tag_versions(tags)
+    if reads_from_replica() and cache.get_many([_recent_key(tag) for tag in tags]):
+        return None
+    return versions
+
+
+def _get_shared(key, tags):
+    """
+    Read an entry from redis along with the current versions of its tags in one round trip.
+    Returns None when missing or built with an outdated tag.
+    """
+    values = cache.get_many([key] + [_tag_key(tag) for tag in tags])
+    envelope = values.pop(key, None)
+    if envelope is None:
+        return None
+    if tags and envelope.get('tags') != get_tag_versions(tags, values):
+        return None
+    local_cache.set(key, envelope)
+    return envelope
+
+
+def _should_refresh(envelope, beta):
+    # XFetch: log() of a uniform (0, 1] number moves the expiry forward by a random multiple of the fill time
+    return time.time() - envelope['delta'] * beta * math.log(1.0 - random.random()) >= envelope['expires']
+
+
+def _fill_on_miss(key, fill, timeout, stale_timeout, tags):
+    deadline = time.monotonic() + FILL_LOCK_WAIT
+    while not (lock := _acquire_fill_lock(key)):
+        if time.monotonic() >= deadline:
+            # The lock holder is too slow, compute it here rather than failing the request
+            stats.incr('lock_timeouts')
+            return _fill(key, fill, timeout, stale_timeout, tags)
+        time.sleep(FILL_LOCK_POLL)
+        envelope = _get_shared(key, tags)
+        if envelope is not None:
+            stats.incr('lock_waits')
+            return envelope['value']
+
+    try:
+        # Another worker may have filled it between our miss and taking the lock
+        envelope = _get_shared(key, tags)
+        if envelope is not None and envelope['expires'] > time.time():
+            return envelope['value']
+        return _fill(key, fill, timeout, stale_timeout, tags)
+    finally:
+        _release_fill_lock(key, lock)
+
+
+def _fill(key, fill, timeout, stale_timeout, tags=()):
+    # Versions are read before the fill, an invalidation racing with it leaves the entry outdated
+    tag_versions = get_tag_versions(tags)
+    start = time.monotonic()
+    # Shared by every client, a replica behind the write that bumped the tags would cache old rows
+    with use_primary():
+        value = fill()
+    delta = time.monotonic() - start
+    stats.incr('fills')
+    stats.incr('fill_seconds', delta)
+
+    envelope = {'value': value, 'expires': time.time() + timeout, 'delta': delta, 'tags': tag_versions}
+    cache.set(key, envelope, timeout=timeout + stale_timeout)
+    # An invalidation during the fill already swept the local tier, keep the outdated value out of it
+    if not tags or get_tag_versions(tags) == tag_versions:
+        local_cache.set(key, envelope)
+    return value
+
 
+def _acquire_fill_lock(key):
+    """
+    Take the fill lock of key with a single SET NX, only one worker gets it.
+    Returns the token that releases it, None when another worker holds it.
+    """
+    token = secrets.token_hex(16)
+    if get_redis_connection('default').set(cache.make_key(f'{key}:lock'), token, nx=True, ex=FILL_LOCK_TIMEOUT):
+        return token
+    return None
 
 
+def _release_fill_lock(key, token):
+    # A fill that outlived the lock timeout must not release the lock of the next filler
+    global _release_lock_script
+    if _release_lock_script is None:
+        _release_lock_script = get_redis_connection('default').register_script(RELEASE_LOCK_SCRIPT)
+    _release_lock_script(keys=[cache.make_key(f'{key}:lock')], args=[token])
@@ -0,0 +1,123 @@
+from asgiref.sync import sync_to_async
+from django_redis import get_redis_connection
+
+from config.db_router import use_primary
+
+# Book ids favorited by each user, as a redis set per user. A set is loaded
+# from the database on its first read and then updated in place by every
+# favorite write, reads cost a single SMEMBERS and no query.
+FAVORITE_SET_TIMEOUT = 60 * 60 * 24
+# Redis drops empty sets, this member keeps the set of a user without favorites
+EMPTY_MEMBER = 0
+
+# Every write bumps the version of the set and only touches it when loaded,
+# a missing one is loaded whole on the next read
+UPDATE_IF_LOADED_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call(ARGV[2], KEYS[1], unpack(ARGV, 3))
+end
+"""
+# A reader loads the ids it queried only if no write came in since it found the
+# set missing, otherwise its snapshot may lack a write whose update was skipped
+LOAD_IF_UNCHANGED_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_update_if_loaded = None
+_load_if_unchanged = None
+
+
+def _get_update_script():
+    global _update_if_loaded
+    if _update_if_loaded is None:
+        _update_if_loaded = get_redis_connection('default').register_script(UPDATE_IF_LOADED_SCRIPT)
+    return _update_if_loaded
+
+
+def _get_load_script():
+    global _load_if_unchanged
+    if _load_if_unchanged is None:
+        _load_if_unchanged = get_redis_connection('default').register_script(LOAD_IF_UNCHANGED_SCRIPT)
+    return _load_if_unchanged
+
+
+def _set_key(user_id):
+    return f'favorites:user:{user_id}'
+
+
+def _version_key(user_id):
+    return f'favorites:user:{user_id}:version'
+
+
+def get_favorite_ids(user):
+    """
+    Return the set of book ids favorited by user, empty for anonymous users.
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+    book_ids, version = _read_set(user.pk)
+    if book_ids is None:
+        # Imported here, the models module imports this one for its signal handlers
+        from apps.book.models import Favorite
+        # Loaded for a day, a replica behind the last favorite write would lose it
+        with use_primary():
+            book_ids = set(Favorite.objects.filter(user_id=user.pk).values_list('book_id', flat=True))
+        _load_set(user.pk, book_ids, version)
+    return book_ids
+
+
+async def aget_favorite_ids(user):
+    """
+    Async get_favorite_ids, the redis calls run off the thread of the ORM
+    queries so they overlap with the other queries of the request.
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+    book_ids, version = await sync_to_async(_read_set, thread_sensitive=False)(user.pk)
+    if book_ids is None:
+        from apps.book.models import Favorite
+        with use_primary():
+            book_ids = {
+                book_id async for book_id in Favorite.objects.filter(user_id=user.pk).values_list('book_id', flat=True)
+            }
+        await sync_to_async(_load_set, thread_sensitive=False)(user.pk, book_ids, version)
+    return book_ids
+
+
+def _read_set(user_id):
+    # The ids, None when the set is not loaded, and the version to load it with
+    pipeline = get_redis_connection('default').pipeline()
+    pipeline.smembers(_set_key(user_id))
+    pipeline.get(_version_key(user_id))
+    members, version = pipeline.execute()
+    if members:
+        return {int(member) for member in members} - {EMPTY_MEMBER}, version
+    return None, version
+
+
+def _load_set(user_id, book_ids, version):
+    _get_load_script()(
+        keys=[_set_key(user_id), _version_key(user_id)],
+        args=[version or '', FAVORITE_SET_TIMEOUT, EMPTY_MEMBER, *book_ids],
+    )
+
+
+def add_favorite_ids(user_id, book_ids):
+    if book_ids:
+        _get_update_script()(
+            keys=[_set_key(user_id), _version_key(user_id)], args=[FAVORITE_SET_TIMEOUT, 'SADD', *book_ids]
+        )
+
+
+def remove_favorite_ids(user_id, book_ids):
+    if book_ids:
+        _get_update_script()(
+            keys=[_set_key(user_id), _version_key(user_id)], args=[FAVORITE_SET_TIMEOUT, 'SREM', *book_ids]
+        )
@@ -1,6 +1,11 @@
 import django_filters
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, Q
+
 from apps.book.models import Book
 
+SEARCH_CONFIG = 'english'
+
 
 class BookFilter(django_filters.FilterSet):
     title = django_filters.CharFilter(field_name='title', lookup_expr='icontains')
@@ -8,10 +13,21 @@ class BookFilter(django_filters.FilterSet):
     created_at_gt = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='gt')
     created_at_lt = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='lt')
     user = django_filters.CharFilter(method='filter_by_user')
+    q = django_filters.CharFilter(method='search')
 
     class Meta:
         model = Book
-        fields = ['title', 'author', 'created_at', 'created_at_lt', 'user']
+        fields = ['title', 'author', 'created_at', 'created_at_lt', 'user', 'q']
 
     def filter_by_user(self, queryset,name,value):
         return queryset.filter(created_by__username=value)
+
+    # Full text match on title, author and description, or a fuzzy title match,
+    # both served by GIN indexes and ranked by relevance
+    def search(self, queryset, name, value):
+        query = SearchQuery(value, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(
+            Q(search_vector=query) | Q(title__trigram_similar=value)
+        ).annotate(
+            rank=SearchRank(F('search_vector'), query) + TrigramSimilarity('title', value)
+        ).order_by('-rank', '-id')
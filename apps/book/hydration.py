@@ -0,0 +1,36 @@
+from django.db.models import Prefetch
+
+from apps.book.models import Book
+from apps.review.models import Review
+
+
+def with_book_relations(queryset, reviews=False):
+    """
+    Join the creator and the rating stats of each book, and optionally batch
+    load the reviews with their authors, so serializing the books costs a
+    constant number of queries instead of a few per book. The tsvector is
+    only used for searching and is never loaded.
+    """
+    queryset = queryset.select_related('created_by', 'rating_stats').defer('search_vector')
+    if reviews:
+        queryset = queryset.prefetch_related(
+            Prefetch('review_set', queryset=Review.objects.select_related('user').order_by('id'))
+        )
+    return queryset
+
+
+def hydrate_books(book_ids, reviews=True):
+    """
+    Load the given books with their relations in bulk, keeping the order of book_ids.
+    Ids of missing or inactive books are skipped.
+    """
+    queryset = with_book_relations(Book.objects.filter(id__in=book_ids, is_active=True), reviews=reviews)
+    books = {book.id: book for book in queryset}
+    return [books[book_id] for book_id in book_ids if book_id in books]
+
+
+async def ahydrate_books(book_ids, reviews=True):
+    # Async hydrate_books
+    queryset = with_book_relations(Book.objects.filter(id__in=book_ids, is_active=True), reviews=reviews)
+    books = {book.id: book async for book in queryset}
+    return [books[book_id] for book_id in book_ids if book_id in books]
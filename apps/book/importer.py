@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+
+from django.db import connection, transaction
+
+from rest_framework import serializers
+
+from apps.book import autocomplete
+from apps.book.cache import invalidate_tags_on_commit
+from apps.book.models import Book
+from apps.book.serializers import BookImportSerializer
+
+IMPORT_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+}
+IMPORT_BATCH_SIZE = 5000
+# Only the first errors are listed in the report, the rest are counted
+MAX_REPORTED_ERRORS = 1000
+
+# Rows are copied into a session local staging table, then moved into book_book with
+# one INSERT ... SELECT whose RETURNING gives the ids for the autocomplete index
+CREATE_STAGING_TABLE = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS book_import (
+        title varchar(200) NOT NULL,
+        author varchar(200) NOT NULL,
+        description text NOT NULL,
+        is_active boolean NOT NULL
+    )
+"""
+COPY_STAGING_TABLE = 'COPY book_import (title, author, description, is_active) FROM STDIN WITH (FORMAT csv)'
+MOVE_STAGED_BOOKS = """
+    INSERT INTO book_book (title, author, description, is_active, created_by_id, created_at, updated_at, favorite_count)
+    SELECT title, author, description, is_active, %s, now(), now(), 0 FROM book_import
+    RETURNING id, title, author, is_active
+"""
+
+
+def read_rows(lines, fmt):
+    """
+    Yield the records of an iterable of text lines, CSV with a header row or one JSON object per line.
+    A line that is not valid JSON is yielded as is and reported by the validation.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line
+
+
+def import_books(rows, created_by, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Validate and load rows in batches, each batch is committed on its own.
+    Returns the number of created books and the errors of the rejected rows,
+    numbered from 1 in the order they were read. A body that stops decoding
+    as UTF-8 ends the import, the rows read before it are still loaded and
+    the report carries a msg naming the last one.
+    """
+    report = {'created': 0, 'failed': 0, 'errors': []}
+    validator = BookImportSerializer()
+    valid = []
+    row_number = 0
+
+    try:
+        for data in rows:
+            row_number += 1
+            try:
+                valid.append(validator.run_validation(data))
+            except serializers.ValidationError as exc:
+                report['failed'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'row': row_number, 'errors': exc.detail})
+            if len(valid) == batch_size:
+                report['created'] += _load_batch(valid, created_by)
+                valid = []
+    except UnicodeDecodeError:
+        report['msg'] = f'The body must be UTF-8 encoded, nothing after row {row_number} was read.'
+    if valid:
+        report['created'] += _load_batch(valid, created_by)
+    return report
+
+
+def _load_batch(rows, created_by):
+    buffer = io.StringIO()
+    # Quoting every value keeps empty strings apart from NULL
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+    for row in rows:
+        writer.writerow((row['title'], row['author'], row['description'], 't' if row.get('is_active', True) else 'f'))
+    buffer.seek(0)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(CREATE_STAGING_TABLE)
+        cursor.execute('TRUNCATE book_import')
+        cursor.copy_expert(COPY_STAGING_TABLE, buffer)
+        cursor.execute(MOVE_STAGED_BOOKS, [created_by.pk])
+        books = [
+            Book(id=book_id, title=title, author=author, is_active=is_active)
+            for book_id, title, author, is_active in cursor.fetchall()
+        ]
+        # COPY skips the model signals, refresh what they would have
+        invalidate_tags_on_commit('books')
+        transaction.on_commit(lambda: autocomplete.index_books(books))
+    return len(books)
@@ -0,0 +1,260 @@
+import math
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django_redis import get_redis_connection
+
+# Book rankings kept in redis sorted sets, updated in O(log n) by every review
+# and favorite write and read with a single ZREVRANGE.
+#
+# rating     Bayesian average, the mean of the book's ratings pulled towards
+#            PRIOR_MEAN by PRIOR_WEIGHT imaginary votes, so a single 5 star
+#            review does not outrank hundreds of 4.8s. The prior is fixed rather
+#            than the running mean of all ratings, so a score only changes with
+#            the reviews of its own book.
+# favorites  Number of favorites.
+# trending   Reviews and favorites decayed by half every TRENDING_HALF_LIFE.
+#
+# rating and favorites also have 7 and 30 day windows, summed from daily buckets.
+# Soft deleted books are kept in INACTIVE_KEY, their later reviews and favorites
+# are still counted but no board ranks them, so a page of a board is never short.
+BOARDS = ('rating', 'favorites', 'trending')
+WINDOWS = {'7d': 7, '30d': 30}
+PRIOR_WEIGHT = 10
+PRIOR_MEAN = 3
+TRENDING_HALF_LIFE = 60 * 60 * 24 * 3
+TRENDING_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc).timestamp()
+TRENDING_SIZE = 10000
+# Daily buckets outlive the longest window by a day
+BUCKET_TIMEOUT = 60 * 60 * 24 * (max(WINDOWS.values()) + 1)
+# Windowed boards are summed again at most this often, by a single worker
+# while the others keep serving the last sum
+WINDOW_TIMEOUT = 60
+WINDOW_STALE_TIMEOUT = 60 * 10
+
+RATING_KEY = 'leaderboard:rating'
+RATING_COUNTS_KEY = 'leaderboard:rating:counts'
+RATING_SUMS_KEY = 'leaderboard:rating:sums'
+FAVORITES_KEY = 'leaderboard:favorites'
+TRENDING_KEY = 'leaderboard:trending'
+INACTIVE_KEY = 'leaderboard:inactive'
+
+RECORD_RATING_SCRIPT = """
+local count = redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[2])
+local sum = redis.call('HINCRBY', KEYS[3], ARGV[1], ARGV[3])
+if count > 0 then
+    if redis.call('SISMEMBER', KEYS[6], ARGV[1]) == 0 then
+        local weight = tonumber(ARGV[4])
+        redis.call('ZADD', KEYS[1], (weight * tonumber(ARGV[5]) + sum) / (weight + count), ARGV[1])
+    end
+else
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[3], ARGV[1])
+end
+redis.call('ZINCRBY', KEYS[4], ARGV[2], ARGV[1])
+redis.call('ZINCRBY', KEYS[5], ARGV[3], ARGV[1])
+redis.call('EXPIRE', KEYS[4], ARGV[6])
+redis.call('EXPIRE', KEYS[5], ARGV[6])
+"""
+
+# Scores are log2 of the decayed sum, so they never overflow: adding an event
+# of score e to s gives max + log2(1 + 2^(min - max)).
+RECORD_TRENDING_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1 then
+    return
+end
+local event = tonumber(ARGV[2])
+local score = event
+local current = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if current then
+    local high = math.max(tonumber(current), event)
+    local low = math.min(tonumber(current), event)
+    score = high + math.log(1 + 2 ^ (low - high)) / math.log(2)
+end
+redis.call('ZADD', KEYS[1], score, ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[3]) - 1)
+"""
+
+# KEYS: the result, the scratch counts and sums, the inactive books, then n daily
+# count buckets and n daily sum buckets
+WINDOW_RATING_SCRIPT = """
+local days = (#KEYS - 4) / 2
+redis.call('ZUNIONSTORE', KEYS[2], days, unpack(KEYS, 5, 4 + days))
+redis.call('ZUNIONSTORE', KEYS[3], days, unpack(KEYS, 5 + days, 4 + 2 * days))
+local counts = redis.call('ZRANGE', KEYS[2], 0, -1, 'WITHSCORES')
+local weight, mean = tonumber(ARGV[1]), tonumber(ARGV[2])
+redis.call('DEL', KEYS[1])
+for i = 1, #counts, 2 do
+    local count = tonumber(counts[i + 1])
+    if count > 0 and redis.call('SISMEMBER', KEYS[4], counts[i]) == 0 then
+        local sum = tonumber(redis.call('ZSCORE', KEYS[3], counts[i]))
+        redis.call('ZADD', KEYS[1], (weight * mean + sum) / (weight + count), counts[i])
+    end
+end
+redis.call('DEL', KEYS[2], KEYS[3])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+"""
+
+_scripts = {}
+
+
+def _script(source):
+    if source not in _scripts:
+        _scripts[source] = get_redis_connection('default').register_script(source)
+    return _scripts[source]
+
+
+def _bucket_key(metric, day):
+    return f'leaderboard:{metric}:{day:%Y-%m-%d}'
+
+
+def _day(at):
+    return (at or datetime.now(dt_timezone.utc)).astimezone(dt_timezone.utc).date()
+
+
+def _trending_score(at=None):
+    # Half-lives since a fixed epoch, a later event weighs twice as much per half-life
+    timestamp = at.timestamp() if at else time.time()
+    return (timestamp - TRENDING_EPOCH) / TRENDING_HALF_LIFE
+
+
+def record_review(book_id, rating, at=None, removed=False):
+    """
+    Add a review to the rating and trending boards, or take it back out of the rating boards.
+    """
+    sign = -1 if removed else 1
+    day = _day(at)
+    _script(RECORD_RATING_SCRIPT)(
+        keys=[
+            RATING_KEY, RATING_COUNTS_KEY, RATING_SUMS_KEY,
+            _bucket_key('review_count', day), _bucket_key('rating_sum', day), INACTIVE_KEY,
+        ],
+        args=[book_id, sign, sign * rating, PRIOR_WEIGHT, PRIOR_MEAN, BUCKET_TIMEOUT],
+    )
+    if not removed:
+        _record_trending(book_id, at)
+
+
+def record_favorites(book_ids, delta):
+    """
+    Add delta favorites to each book, a new favorite also counts towards trending.
+    """
+    if not book_ids:
+        return
+    connection = get_redis_connection('default')
+    inactive = connection.smismember(INACTIVE_KEY, book_ids)
+    bucket_key = _bucket_key('favorites', _day(None))
+    pipeline = connection.pipeline()
+    for book_id, is_inactive in zip(book_ids, inactive):
+        if not is_inactive:
+            pipeline.zincrby(FAVORITES_KEY, delta, book_id)
+        pipeline.zincrby(bucket_key, delta, book_id)
+    pipeline.expire(bucket_key, BUCKET_TIMEOUT)
+    # Books whose last favorite was removed leave the board
+    pipeline.zremrangebyscore(FAVORITES_KEY, '-inf', 0)
+    pipeline.execute()
+    if delta > 0:
+        for book_id in book_ids:
+            _record_trending(book_id)
+
+
+def _record_trending(book_id, at=None):
+    _script(RECORD_TRENDING_SCRIPT)(keys=[TRENDING_KEY, INACTIVE_KEY], args=[book_id, _trending_score(at), TRENDING_SIZE])
+
+
+def remove_book(book_id):
+    """
+    Drop a soft deleted book from every board and keep it out of them until the next rebuild.
+    """
+    pipeline = get_redis_connection('default').pipeline()
+    pipeline.sadd(INACTIVE_KEY, book_id)
+    window_keys = [f'leaderboard:{board}:{window}' for board in ('rating', 'favorites') for window in WINDOWS]
+    for key in (RATING_KEY, FAVORITES_KEY, TRENDING_KEY, *window_keys):
+        pipeline.zrem(key, book_id)
+    pipeline.execute()
+
+
+def top(board, limit=10, window=None):
+    """
+    Return [(book_id, score)] of the first limit books of a board, best first.
+    """
+    connection = get_redis_connection('default')
+    if window is None:
+        key = {'rating': RATING_KEY, 'favorites': FAVORITES_KEY, 'trending': TRENDING_KEY}[board]
+    else:
+        key = f'leaderboard:{board}:{window}'
+        _refresh_window(connection, board, window, key)
+    return [
+        (int(member), score)
+        for member, score in connection.zrevrange(key, 0, limit - 1, withscores=True)
+        if score > 0
+    ]
+
+
+def _refresh_window(connection, board, window, key):
+    # SET NX on the freshness marker elects the worker that sums the board again,
+    # the board itself outlives the marker so nobody reads a missing key meanwhile
+    if not connection.set(f'{key}:fresh', 1, nx=True, ex=WINDOW_TIMEOUT):
+        return
+    today = _day(None)
+    days = [today - timedelta(days=offset) for offset in range(WINDOWS[window])]
+    if board == 'favorites':
+        pipeline = connection.pipeline()
+        pipeline.zunionstore(key, [_bucket_key('favorites', day) for day in days])
+        pipeline.zdiffstore(key, [key, INACTIVE_KEY])
+        pipeline.expire(key, WINDOW_STALE_TIMEOUT)
+        pipeline.execute()
+    else:
+        _script(WINDOW_RATING_SCRIPT)(
+            keys=[key, f'{key}:counts', f'{key}:sums', INACTIVE_KEY]
+            + [_bucket_key('review_count', day) for day in days]
+            + [_bucket_key('rating_sum', day) for day in days],
+            args=[PRIOR_WEIGHT, PRIOR_MEAN, WINDOW_STALE_TIMEOUT],
+        )
+
+
+def rebuild(rating_stats, favorite_counts, reviews, favorites, inactive_book_ids=()):
+    """
+    Replace every board. rating_stats yields (book_id, review_count, rating_sum),
+    favorite_counts (book_id, count), reviews (book_id, rating, created_at) and
+    favorites (book_id, created_at) for the rows of the last 30 days, all of
+    active books, and inactive_book_ids the soft deleted books.
+    """
+    connection = get_redis_connection('default')
+    stale_keys = list(connection.scan_iter('leaderboard:*'))
+    if stale_keys:
+        connection.delete(*stale_keys)
+
+    pipeline = connection.pipeline()
+    for book_id in inactive_book_ids:
+        pipeline.sadd(INACTIVE_KEY, book_id)
+    ranked = 0
+    for book_id, count, rating_sum in rating_stats:
+        if count:
+            ranked += 1
+            pipeline.hset(RATING_COUNTS_KEY, book_id, count)
+            pipeline.hset(RATING_SUMS_KEY, book_id, rating_sum)
+            pipeline.zadd(RATING_KEY, {book_id: (PRIOR_WEIGHT * PRIOR_MEAN + rating_sum) / (PRIOR_WEIGHT + count)})
+    for book_id, count in favorite_counts:
+        if count:
+            pipeline.zadd(FAVORITES_KEY, {book_id: count})
+
+    trending, bucket_keys = {}, set()
+    for book_id, rating, created_at in reviews:
+        day = _day(created_at)
+        bucket_keys.update((_bucket_key('review_count', day), _bucket_key('rating_sum', day)))
+        pipeline.zincrby(_bucket_key('review_count', day), 1, book_id)
+        pipeline.zincrby(_bucket_key('rating_sum', day), rating, book_id)
+        trending.setdefault(book_id, []).append(_trending_score(created_at))
+    for book_id, created_at in favorites:
+        bucket_keys.add(_bucket_key('favorites', _day(created_at)))
+        pipeline.zincrby(_bucket_key('favorites', _day(created_at)), 1, book_id)
+        trending.setdefault(book_id, []).append(_trending_score(created_at))
+    for book_id, events in trending.items():
+        high = max(events)
+        pipeline.zadd(TRENDING_KEY, {book_id: high + math.log2(sum(2 ** (event - high) for event in events))})
+    for bucket_key in bucket_keys:
+        pipeline.expire(bucket_key, BUCKET_TIMEOUT)
+    pipeline.execute()
+    return ranked
@@ -0,0 +1,58 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.book.hydration import with_book_relations
+from apps.book.models import Book
+from apps.book.rendering import book_values, render_book
+from apps.book.serializers import BookSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare rows per second of BookSerializer and the values() rendering of the book list.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # The sample books are created in a transaction that is always rolled back
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, rows, repeat):
+        user = User.objects.create(username='bench-user', email='bench@example.com')
+        Book.objects.bulk_create(
+            Book(title=f'Book {i}', author=f'Author {i % 100}', description='x' * 200, created_by=user)
+            for i in range(rows)
+        )
+        queryset = Book.objects.filter(created_by=user)
+
+        def serializer():
+            return BookSerializer(with_book_relations(queryset), many=True).data
+
+        def values():
+            return [render_book(row) for row in book_values(queryset)]
+
+        results = {}
+        for name, render in (('BookSerializer', serializer), ('values()', values)):
+            best = min(self.timed(render) for _ in range(repeat))
+            results[name] = rows / best
+            self.stdout.write(f'{name:>15}: {results[name]:>10.0f} rows/s')
+        speedup = results['values()'] / results['BookSerializer']
+        self.stdout.write(self.style.SUCCESS(f'values() rendering is {speedup:.1f}x faster'))
+
+    def timed(self, render):
+        start = time.perf_counter()
+        render()
+        return time.perf_counter() - start
@@ -0,0 +1,34 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.book.importer import IMPORT_BATCH_SIZE, read_rows, import_books
+
+
+class Command(BaseCommand):
+    help = 'Import books from a CSV file with a title,author,description[,is_active] header or an NDJSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, - reads standard input.')
+        parser.add_argument('--created-by', required=True, help='Username recorded as the creator of the books.')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            created_by = User.objects.get(username=options['created_by'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['created_by']} does not exist.")
+
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        with stream:
+            report = import_books(read_rows(stream, fmt), created_by, options['batch_size'])
+
+        for error in report['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        if report['failed'] > len(report['errors']):
+            self.stderr.write(f"... {report['failed'] - len(report['errors'])} more rejected rows.")
+        self.stdout.write(self.style.SUCCESS(f"Imported {report['created']} books, rejected {report['failed']} rows."))
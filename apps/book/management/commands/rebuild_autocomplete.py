@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from apps.book import autocomplete
+from apps.book.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the title and author autocomplete index from the active books.'
+
+    def handle(self, *args, **options):
+        books = Book.objects.filter(is_active=True).only('id', 'title', 'author', 'is_active')
+        count = autocomplete.rebuild(books.iterator(chunk_size=2000))
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} books.'))
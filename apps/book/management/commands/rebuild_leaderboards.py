@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.book import leaderboards
+from apps.book.models import Book, Favorite
+from apps.review.models import BookRating, Review
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the rating, favorites and trending leaderboards from the database.'
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=max(leaderboards.WINDOWS.values()))
+        count = leaderboards.rebuild(
+            BookRating.objects.filter(book__is_active=True).values_list('book_id', 'review_count', 'rating_sum').iterator(),
+            Book.objects.filter(is_active=True, favorite_count__gt=0).values_list('id', 'favorite_count').iterator(),
+            Review.objects.filter(created_at__gte=since, book__is_active=True).values_list('book_id', 'rating', 'created_at').iterator(),
+            Favorite.objects.filter(created_at__gte=since, book__is_active=True).values_list('book_id', 'created_at').iterator(),
+            Book.objects.filter(is_active=False).values_list('id', flat=True).iterator(),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Ranked {count} rated books.'))
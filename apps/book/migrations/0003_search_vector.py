@@ -0,0 +1,57 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0002_favorite_created_at_and_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # Keep the tsvector in sync on every insert and on updates of the searched columns,
+        # this also covers bulk inserts that never go through Book.save()
+        migrations.RunSQL(
+            sql="""
+                CREATE FUNCTION book_search_vector_update() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector :=
+                        setweight(to_tsvector('pg_catalog.english', coalesce(NEW.title, '')), 'A') ||
+                        setweight(to_tsvector('pg_catalog.english', coalesce(NEW.author, '')), 'B') ||
+                        setweight(to_tsvector('pg_catalog.english', coalesce(NEW.description, '')), 'C');
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER book_search_vector_trigger
+                    BEFORE INSERT OR UPDATE OF title, author, description ON book_book
+                    FOR EACH ROW EXECUTE FUNCTION book_search_vector_update();
+
+                UPDATE book_book SET title = title;
+            """,
+            reverse_sql="""
+                DROP TRIGGER book_search_vector_trigger ON book_book;
+                DROP FUNCTION book_search_vector_update();
+            """,
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='book_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
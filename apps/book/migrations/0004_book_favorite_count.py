@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0003_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='favorite_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE book_book SET favorite_count = counts.total
+                FROM (SELECT book_id, count(*) AS total FROM book_favorite GROUP BY book_id) AS counts
+                WHERE book_book.id = counts.book_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
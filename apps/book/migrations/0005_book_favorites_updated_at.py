@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0004_book_favorite_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='favorites_updated_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE book_book SET favorites_updated_at = latest.created_at
+                FROM (SELECT book_id, max(created_at) AS created_at FROM book_favorite GROUP BY book_id) AS latest
+                WHERE book_book.id = latest.book_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,5 +1,13 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.dispatch import receiver
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import User
+from django.db.models.functions import Now, Upper
+from django.db.models.signals import post_save, post_delete
+
+from apps.book import autocomplete, favorites, leaderboards
+from apps.book.cache import invalidate_tags_on_commit
 
 class Book(models.Model):
     title = models.CharField(max_length=200)
@@ -9,20 +17,186 @@ class Book(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Weighted title, author and description, maintained by a database trigger
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Maintained by every favorite write, like the rating stats by reviews
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
+    # Time of the last favorite added or removed, part of the detail Last-Modified
+    favorites_updated_at = models.DateTimeField(null=True, editable=False)
+
+    # Keyset pagination of the active books walks the created_at index,
+    # full text search the tsvector and fuzzy title matching the trigrams.
+    # The ?title= filter compiles to UPPER(title) LIKE, served by the trigrams of UPPER(title).
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='book_active_created_idx',
+                condition=models.Q(is_active=True),
+            ),
+            GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+            GinIndex(fields=['title'], name='book_title_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(OpClass(Upper('title'), name='gin_trgm_ops'), name='book_title_upper_trgm_idx'),
+        ]
+
+    # Kept in SQL by the favorite writes and the search trigger, an instance loaded
+    # before one of those writes must not write them back
+    SQL_MAINTAINED_FIELDS = ('favorite_count', 'favorites_updated_at', 'search_vector')
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Updates leave those fields alone unless named in update_fields, deferred ones are not loaded for it
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skipped = {*self.SQL_MAINTAINED_FIELDS, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped and field.attname not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+
+# Only active books can be favorited. The main query reads the snapshot taken before
+# the insert, so the join with book_favorite finds the favorites that already existed.
+ADD_FAVORITES = """
+    WITH book AS (
+        SELECT id FROM book_book WHERE id = ANY(%(book_ids)s) AND is_active
+    ), inserted AS (
+        INSERT INTO book_favorite (user_id, book_id, created_at)
+        SELECT %(user_id)s, id, now() FROM book
+        ON CONFLICT (user_id, book_id) DO NOTHING
+        RETURNING id, book_id
+    ), counted AS (
+        UPDATE book_book SET favorite_count = favorite_count + 1, favorites_updated_at = now()
+        WHERE id IN (SELECT book_id FROM inserted)
+    )
+    SELECT book.id, COALESCE(inserted.id, favorite.id), inserted.id IS NOT NULL
+    FROM book
+    LEFT JOIN inserted ON inserted.book_id = book.id
+    LEFT JOIN book_favorite favorite ON favorite.book_id = book.id AND favorite.user_id = %(user_id)s
+"""
+REMOVE_FAVORITES = """
+    WITH removed AS (
+        DELETE FROM book_favorite WHERE user_id = %(user_id)s AND book_id = ANY(%(book_ids)s)
+        RETURNING book_id
+    ), counted AS (
+        UPDATE book_book SET favorite_count = favorite_count - 1, favorites_updated_at = now()
+        WHERE id IN (SELECT book_id FROM removed)
+    )
+    SELECT book_id FROM removed
+"""
+
+
+class FavoriteManager(models.Manager):
+    """
+    Favorite writes in a single statement whatever the number of books. They
+    bypass the model signals, the favorite counts, the favorite sets of the
+    user and the cache tags are kept in step here instead.
+    """
+
+    def add_books(self, user_id, book_ids):
+        """
+        Favorite the given books, those already favorited are left as they are.
+        Returns {book_id: (favorite_id, created)} for every active book among book_ids.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(ADD_FAVORITES, {'user_id': user_id, 'book_ids': list(book_ids)})
+            added = {book_id: (favorite_id, created) for book_id, favorite_id, created in cursor.fetchall()}
+        # A concurrent transaction inserted these pairs after the snapshot, the conflict skipped
+        # ours and the join missed theirs. Committed by now, a new query sees them.
+        missing = [book_id for book_id, (favorite_id, _) in added.items() if favorite_id is None]
+        if missing:
+            for book_id, favorite_id in self.filter(user_id=user_id, book_id__in=missing).values_list('book_id', 'id'):
+                added[book_id] = (favorite_id, False)
+        new_book_ids = [book_id for book_id, (_, created) in added.items() if created]
+        self._invalidate(user_id, new_book_ids)
+        transaction.on_commit(lambda: favorites.add_favorite_ids(user_id, new_book_ids))
+        transaction.on_commit(lambda: leaderboards.record_favorites(new_book_ids, 1))
+        return added
+
+    def remove_books(self, user_id, book_ids):
+        """
+        Unfavorite the given books, returns the ids of the books that were favorited.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(REMOVE_FAVORITES, {'user_id': user_id, 'book_ids': list(book_ids)})
+            removed = [book_id for book_id, in cursor.fetchall()]
+        self._invalidate(user_id, removed)
+        transaction.on_commit(lambda: favorites.remove_favorite_ids(user_id, removed))
+        transaction.on_commit(lambda: leaderboards.record_favorites(removed, -1))
+        return removed
+
+    def _invalidate(self, user_id, book_ids):
+        if book_ids:
+            invalidate_tags_on_commit(
+                'favorites', f'user_favorites:{user_id}', *[f'book:{book_id}' for book_id in book_ids]
+            )
+
 
 # Model representing a user's favorite book
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = FavoriteManager()
 
     #  a user can not favorite the same book more than once
     class Meta:
         unique_together = ('user', 'book')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='favorite_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}'s favorite: {self.book.title}"
 
+
+# Drop the cached entries built from a book or a favorite once the write is committed
+@receiver([post_save, post_delete], sender=Book)
+def invalidate_book_cache(sender, instance, **kwargs):
+    invalidate_tags_on_commit('books', f'book:{instance.pk}')
+
+
+# Keep the autocomplete index in step with created, edited and soft deleted books
+@receiver(post_save, sender=Book)
+def index_book_autocomplete(sender, instance, **kwargs):
+    transaction.on_commit(lambda: autocomplete.index_book(instance))
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_autocomplete(sender, instance, **kwargs):
+    transaction.on_commit(lambda: autocomplete.remove_book(instance))
+
+
+# Soft deleted books leave the leaderboards, rebuild_leaderboards brings back reactivated ones
+@receiver(post_save, sender=Book)
+def remove_inactive_book_leaderboards(sender, instance, **kwargs):
+    if not instance.is_active:
+        transaction.on_commit(lambda: leaderboards.remove_book(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+def invalidate_favorite_cache(sender, instance, **kwargs):
+    invalidate_tags_on_commit('favorites', f'book:{instance.book_id}', f'user_favorites:{instance.user_id}')
+
+
+# Favorites written through the ORM, the admin or a cascade keep the counts and sets in step too
+@receiver(post_save, sender=Favorite)
+def count_saved_favorite(sender, instance, created, **kwargs):
+    if created:
+        Book.objects.filter(pk=instance.book_id).update(
+            favorite_count=models.F('favorite_count') + 1, favorites_updated_at=Now()
+        )
+        transaction.on_commit(lambda: favorites.add_favorite_ids(instance.user_id, [instance.book_id]))
+        transaction.on_commit(lambda: leaderboards.record_favorites([instance.book_id], 1))
+
+
+@receiver(post_delete, sender=Favorite)
+def count_deleted_favorite(sender, instance, **kwargs):
+    Book.objects.filter(pk=instance.book_id).update(
+        favorite_count=models.F('favorite_count') - 1, favorites_updated_at=Now()
+    )
+    transaction.on_commit(lambda: favorites.remove_favorite_ids(instance.user_id, [instance.book_id]))
+    transaction.on_commit(lambda: leaderboards.record_favorites([instance.book_id], -1))
@@ -0,0 +1,82 @@
+"""
+Plain dict rendering of list responses. Rows are read with values() and the
+joins they need, which skips model instantiation and per field serializer
+calls. The output matches BookSerializer.
+"""
+
+BOOK_VALUES = (
+    'id',
+    'title',
+    'author',
+    'description',
+    'is_active',
+    'created_at',
+    'created_by_id',
+    'created_by__username',
+    'created_by__email',
+    'rating_stats__average_rating',
+    'rating_stats__review_count',
+    'favorite_count',
+)
+
+FAVORITE_VALUES = ('id', 'book_id', 'created_at')
+
+# Favorites with their book, joined in the same query as the page
+FAVORITE_FEED_VALUES = ('id', 'created_at') + tuple(f'book__{field}' for field in BOOK_VALUES)
+
+# Flat columns of the streaming exports
+BOOK_EXPORT_COLUMNS = (
+    'id',
+    'title',
+    'author',
+    'description',
+    'created_at',
+    'updated_at',
+    'created_by_id',
+    'created_by__username',
+    'rating_stats__average_rating',
+    'rating_stats__review_count',
+    'favorite_count',
+)
+
+FAVORITE_EXPORT_COLUMNS = ('id', 'book_id', 'book__title', 'book__author', 'created_at')
+
+
+def book_values(queryset):
+    return queryset.values(*BOOK_VALUES)
+
+
+def render_book(row, favorite_ids=()):
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'author': row['author'],
+        'description': row['description'],
+        'is_active': row['is_active'],
+        'created_by': {
+            'id': row['created_by_id'],
+            'username': row['created_by__username'],
+            'email': row['created_by__email'],
+        },
+        'average_rating': row['rating_stats__average_rating'],
+        'review_count': row['rating_stats__review_count'] or 0,
+        'favorite_count': row['favorite_count'],
+        'is_favorited': row['id'] in favorite_ids,
+    }
+
+
+def favorite_values(queryset):
+    return queryset.values(*FAVORITE_VALUES)
+
+
+def render_favorite(row):
+    return {'book': row['book_id']}
+
+
+def favorite_feed_values(queryset):
+    return queryset.values(*FAVORITE_FEED_VALUES)
+
+
+def render_favorite_feed(row):
+    book = render_book({field: row[f'book__{field}'] for field in BOOK_VALUES}, favorite_ids=(row['book__id'],))
+    return {'id': row['id'], 'favorited_at': row['created_at'], 'book': book}
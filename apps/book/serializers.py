@@ -1,14 +1,15 @@
-from django.db import IntegrityError
-
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
 
-from apps.book.models import Book,Favorite
-from apps.user.serializer import UserSerializer
+from apps.book.models import Book
+from apps.user.serializer import UserSummarySerializer
 
 
 class BookSerializer(serializers.ModelSerializer):
-    created_by= UserSerializer(read_only=True)
+    created_by= UserSummarySerializer(read_only=True)
+    average_rating = serializers.SerializerMethodField()
+    review_count = serializers.SerializerMethodField()
+    is_favorited = serializers.SerializerMethodField()
     class Meta:
         model = Book
         fields = (
@@ -17,9 +18,26 @@ class BookSerializer(serializers.ModelSerializer):
                 'author',
                 'description', 
                 'is_active',
-                'created_by'
+                'created_by',
+                'average_rating',
+                'review_count',
+                'favorite_count',
+                'is_favorited'
                 )
-        read_only_fields = ('created_at', 'updated_at',)
+        read_only_fields = ('created_at', 'updated_at', 'favorite_count')
+
+    # Rating stats are read from the denormalized row, a book without reviews has none
+    def get_average_rating(self, obj):
+        stats = getattr(obj, 'rating_stats', None)
+        return stats.average_rating if stats else None
+
+    def get_review_count(self, obj):
+        stats = getattr(obj, 'rating_stats', None)
+        return stats.review_count if stats else 0
+
+    # The view puts the favorite ids of the requesting user in the context, a set lookup per book
+    def get_is_favorited(self, obj):
+        return obj.id in self.context.get('favorite_ids', ())
         
     #  create method to set the created_by field to the current user
     def create(self, validated_data):
@@ -32,28 +50,19 @@ class BookSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
    
 
-#Favorite book serializer
-class FavoriteSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
-    book = serializers.PrimaryKeyRelatedField(queryset=Book.objects.all())
-
+# Row of a bulk import, validated without a request
+class BookImportSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Favorite
-        fields = ['id', 'user', 'book']
-
-    def create(self, validated_data):
-        validated_data['user'] = self.context['request'].user
-        try:
-            return super().create(validated_data)
-        except IntegrityError:
-            raise serializers.ValidationError({'detail': 'You have already added this book to your favorite list.'})
-
-
-class FavoriteBookSerializer(serializers.ModelSerializer):
-    book = serializers.PrimaryKeyRelatedField(queryset=Book.objects.all())
+        model = Book
+        fields = ('title', 'author', 'description', 'is_active')
 
-    class Meta:
-        model = Favorite
-        fields = ['book']
 
+# Books to add to and remove from the favorites of the user in one request
+class FavoriteBatchSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(min_value=1), max_length=1000, default=list)
+    remove = serializers.ListField(child=serializers.IntegerField(min_value=1), max_length=1000, default=list)
 
+    def validate(self, attrs):
+        if set(attrs['add']) & set(attrs['remove']):
+            raise serializers.ValidationError('A book can not be both added and removed.')
+        return attrs
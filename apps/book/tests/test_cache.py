@@ -0,0 +1,116 @@
+import time
+from unittest.mock import Mock, patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from apps.book import cache as book_cache
+
+
+class TestCacheLayer(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        book_cache.local_cache.clear()
+        book_cache.stats.reset()
+
+    def test_fill_once_then_hit(self):
+        """
+        Test case for a cold miss followed by hits.
+        Verifies that fill() runs once and the local tier serves the next reads.
+        """
+        fill = Mock(return_value=[1, 2, 3])
+        for _ in range(3):
+            self.assertEqual(book_cache.get_or_fill('key', fill, timeout=60), [1, 2, 3])
+
+        fill.assert_called_once()
+        counters = book_cache.get_cache_stats()
+        self.assertEqual(counters['misses'], 1)
+        self.assertEqual(counters['fills'], 1)
+        self.assertEqual(counters['hits'], 2)
+        self.assertEqual(counters['local_hits'], 2)
+
+        # A second process only finds the value in redis
+        book_cache.local_cache.clear()
+        self.assertEqual(book_cache.get_or_fill('key', fill, timeout=60), [1, 2, 3])
+        counters = book_cache.get_cache_stats()
+        self.assertEqual(counters['hits'], 3)
+        self.assertEqual(counters['local_hits'], 2)
+        fill.assert_called_once()
+
+    def test_stale_value_served_while_refilling(self):
+        """
+        Test case for stale-while-revalidate.
+        Verifies that:
+        1. An expired value is served as is while another worker holds the fill lock.
+        2. The lock holder refreshes it.
+        """
+        book_cache.get_or_fill('key', lambda: 'old', timeout=60)
+        envelope = cache.get('key')
+        envelope['expires'] = time.time() - 1
+        cache.set('key', envelope)
+        book_cache.local_cache.clear()
+
+        cache.add('key:lock', 1)
+        fill = Mock(return_value='new')
+        self.assertEqual(book_cache.get_or_fill('key', fill, timeout=60), 'old')
+        fill.assert_not_called()
+
+        cache.delete('key:lock')
+        book_cache.local_cache.clear()
+        self.assertEqual(book_cache.get_or_fill('key', fill, timeout=60), 'new')
+        self.assertEqual(book_cache.get_cache_stats()['stale_hits'], 2)
+
+    def test_miss_waits_for_lock_holder(self):
+        """
+        Test case for single-flight fills.
+        Verifies that a miss while another worker fills uses its result instead of filling again.
+        """
+        cache.add('key:lock', 1)
+
+        def fill_by_other_worker(seconds):
+            book_cache._fill('key', lambda: 'filled', 60, 60)
+            book_cache.local_cache.clear()
+
+        fill = Mock(return_value='mine')
+        with patch.object(book_cache.time, 'sleep', side_effect=fill_by_other_worker):
+            self.assertEqual(book_cache.get_or_fill('key', fill, timeout=60), 'filled')
+        fill.assert_not_called()
+        self.assertEqual(book_cache.get_cache_stats()['lock_waits'], 1)
+
+    def test_fill_lock_released_by_its_owner_only(self):
+        """
+        Test case for a fill that outlives its lock.
+        Verifies that releasing it leaves the lock another worker took in the meantime.
+        """
+        def slow_fill():
+            # The lock expires during the fill and the next worker takes it
+            cache.delete('key:lock')
+            cache.add('key:lock', 1)
+            return 'value'
+
+        self.assertEqual(book_cache.get_or_fill('key', slow_fill, timeout=60), 'value')
+        self.assertEqual(cache.get('key:lock'), 1)
+        self.assertIsNone(book_cache._acquire_fill_lock('key'))
+
+    def test_invalidate_tags(self):
+        """
+        Test case for tag based invalidation.
+        Verifies that:
+        1. Invalidating a tag drops the entries built with it in both tiers.
+        2. Entries built with other tags are kept.
+        """
+        book_cache.get_or_fill('top', lambda: 'v1', timeout=60, tags=('books', 'reviews'))
+        book_cache.get_or_fill('favorites', lambda: 'f1', timeout=60, tags=('favorites',))
+
+        book_cache.invalidate_tags('reviews')
+
+        self.assertEqual(book_cache.get_or_fill('top', lambda: 'v2', timeout=60, tags=('books', 'reviews')), 'v2')
+        self.assertEqual(book_cache.get_or_fill('favorites', lambda: 'f2', timeout=60, tags=('favorites',)), 'f1')
+
+        # Another process still holding the old value in redis only
+        book_cache.get_or_fill('top', lambda: 'v3', timeout=60, tags=('books', 'reviews'))
+        book_cache.local_cache.clear()
+        book_cache.invalidate_tags('books')
+        self.assertEqual(book_cache.get_or_fill('top', lambda: 'v4', timeout=60, tags=('books', 'reviews')), 'v4')
+        self.assertEqual(book_cache.get_cache_stats()['invalidations'], 2)
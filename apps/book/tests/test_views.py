@@ -1,6 +1,37 @@
+import csv
+import gzip
+import io
+import json
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+import msgpack
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_redis import get_redis_connection
+
 from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITransactionTestCase
 
+from apps.book import autocomplete, favorites
+from apps.book.cache import local_cache
+from apps.book.filters import BookFilter
+from apps.book.models import Book, Favorite
+from apps.book.serializers import BookSerializer
 from apps.book.tests.factories import BookFactory,FavoriteFactory
+from apps.review.serializer import ReviewSerializer
+from apps.review.models import BookRating, Review
+from apps.review.tests.factories import ReviewFactory
+from apps.user.tests.factories import UserFactory
+from config.slow_queries import get_slow_queries
 from config.test import TestApi
 
 
@@ -148,6 +179,15 @@ class TestBookViews(TestApi):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.data['book'], book.id)
 
+        # Favoriting again is idempotent and answers with the same favorite
+        favorite_id = response.data['id']
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], favorite_id)
+
+        response = self.client.post(f'/book/{book.id + 1000}/favorite/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 
     def test_unfavorite_book(self):
         """
@@ -222,7 +262,878 @@ class TestBookViews(TestApi):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
       
+    def test_title_filter_uses_trigram_index(self):
+        """
+        Test case for the ?title= filter.
+        Verifies that:
+        1. The case insensitive substring match is served by the trigram index of UPPER(title).
+        """
+        BookFactory(title='The Hobbit')
+        queryset = BookFilter({'title': 'hobbi'}, queryset=Book.objects.all()).qs
+        self.assertEqual(queryset.count(), 1)
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assertIn('book_title_upper_trgm_idx', queryset.explain())
+
     def test_top_rated_books(self):
         url = '/book/top-10-rated/'
         response = self.client.get(url)
         self.assertIn(response.status_code, [status.HTTP_200_OK, status.HTTP_404_NOT_FOUND])
+
+    def test_top_rated_books_query_count(self):
+        """
+        Test case for the batched hydration of top rated books.
+        Verifies that the number of queries does not grow with the number of
+        books, reviews and review authors.
+        """
+        for rating in (5, 4, 3):
+            book = BookFactory()
+            for _ in range(3):
+                ReviewFactory(book=book, rating=rating)
+            BookRating.objects.record_review(book.id, rating)
+
+        # stats ranking, books with creators and stats, reviews with authors
+        with self.assertNumQueries(3):
+            response = self.client.get('/book/top-10-rated/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([book['average_rating'] for book in response.data], [5, 4, 3])
+        self.assertEqual(len(response.data[0]['reviews']), 3)
+
+    def test_retrieve_book_query_count(self):
+        """
+        Test case for retrieving a book with its reviews in a constant number of queries.
+        """
+        book = BookFactory()
+        for _ in range(5):
+            ReviewFactory(book=book)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/book/{book.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['reviews']), 5)
+        self.assertEqual(response.data['created_by']['id'], book.created_by.id)
+
+    def test_top_rated_books_invalidated_by_review(self):
+        """
+        Test case for invalidating the cached top rated books.
+        Verifies that a committed review shows up without waiting for the cache timeout.
+        """
+        book = BookFactory()
+        response = self.client.get('/book/top-10-rated/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(user=self.create_user())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/review/', {'book': book.id, 'rating': 5, 'review_text': 'Great'})
+
+        response = self.client.get('/book/top-10-rated/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['id'], book.id)
+
+    def test_list_books_cursor_pagination(self):
+        """
+        Test case for keyset pagination of books and of the reviews embedded in a book.
+        Verifies that following the next links returns every row once, newest first.
+        """
+        books = [BookFactory() for _ in range(5)]
+        response = self.client.get('/book/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        ids = []
+        while True:
+            ids += [book['id'] for book in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(ids, [book.id for book in reversed(books)])
+
+        for _ in range(3):
+            ReviewFactory(book=books[0])
+        response = self.client.get(f'/book/{books[0].id}/', {'reviews_page_size': 2})
+        self.assertEqual(len(response.data['reviews']), 2)
+        response = self.client.get(response.data['reviews_next'])
+        self.assertEqual(len(response.data['reviews']), 1)
+        self.assertIsNone(response.data['reviews_next'])
+
+    def test_search_books(self):
+        """
+        Test case for the ?q= search.
+        Verifies that:
+        1. Words are matched in the title, author and description, title matches ranked first.
+        2. Misspelled titles are matched through trigram similarity.
+        3. The tsvector is kept up to date when a book is edited.
+        4. A page size of 0 still returns one result per page.
+        """
+        hobbit = BookFactory(title='The Hobbit', author='J. R. R. Tolkien', description='A dragon guards gold.')
+        rings = BookFactory(title='The Fellowship of the Ring', author='J. R. R. Tolkien', description='A hobbit leaves home.')
+        BookFactory(title='Dune', author='Frank Herbert', description='Spice and sand.')
+
+        response = self.client.get('/book/', {'q': 'hobbit'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([book['id'] for book in response.data['results']], [hobbit.id, rings.id])
+
+        response = self.client.get('/book/', {'q': 'Hobit'})
+        self.assertEqual([book['id'] for book in response.data['results']], [hobbit.id])
+
+        response = self.client.get('/book/', {'q': 'tolkien'})
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get('/book/', {'q': 'tolkien', 'page_size': 0})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIn('offset=1', response.data['next'])
+
+        self.client.force_authenticate(user=hobbit.created_by)
+        self.client.patch(f'/book/{hobbit.id}/', {'description': 'Smaug sleeps under the mountain.'})
+        response = self.client.get('/book/', {'q': 'smaug'})
+        self.assertEqual([book['id'] for book in response.data['results']], [hobbit.id])
+
+    def test_autocomplete(self):
+        """
+        Test case for title and author autocomplete.
+        Verifies that:
+        1. Titles complete from their first word and from later words, shortest match first.
+        2. Authors are completed once even when they wrote several books.
+        3. Edited and soft deleted books are updated in the index.
+        4. The limit is clamped, a negative one does not read the whole index.
+        5. An author of many books does not hide the other matching authors.
+        6. A rebuild keeps serving the old index until the new one is swapped in.
+        """
+        user = self.create_user()
+        with self.captureOnCommitCallbacks(execute=True):
+            hobbit = BookFactory(title='The Hobbit', author='J. R. R. Tolkien', created_by=user)
+            BookFactory(title='The Silmarillion', author='J. R. R. Tolkien')
+            BookFactory(title='Hobbit Lore', author='Someone Else')
+
+        url = '/book/autocomplete/'
+        response = self.client.get(url, {'q': 'hob'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([book['title'] for book in response.data], ['The Hobbit', 'Hobbit Lore'])
+
+        response = self.client.get(url, {'q': 'j. r', 'field': 'author'})
+        self.assertEqual(response.data, [{'author': 'J. R. R. Tolkien'}])
+        response = self.client.get(url, {'q': 'hob', 'limit': -1})
+        self.assertEqual([book['title'] for book in response.data], ['The Hobbit'])
+
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/book/{hobbit.id}/', {'title': 'There and Back Again'})
+        response = self.client.get(url, {'q': 'the'})
+        self.assertEqual([book['title'] for book in response.data], ['The Silmarillion', 'There and Back Again'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/book/{hobbit.id}/')
+        response = self.client.get(url, {'q': 'the'})
+        self.assertEqual([book['title'] for book in response.data], ['The Silmarillion'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BookFactory.create_batch(12, author='Prolific Author')
+            BookFactory(author='Proust')
+        response = self.client.get(url, {'q': 'pro', 'field': 'author', 'limit': 2})
+        self.assertEqual(response.data, [{'author': 'Prolific Author'}, {'author': 'Proust'}])
+
+        index_books = autocomplete.index_books
+
+        def index_while_serving(books, keys=autocomplete.INDEX_KEYS):
+            self.assertEqual(len(self.client.get(url, {'q': 'the'}).data), 1)
+            index_books(books, keys)
+
+        with patch('apps.book.autocomplete.index_books', index_while_serving):
+            call_command('rebuild_autocomplete', stdout=io.StringIO())
+        response = self.client.get(url, {'q': 'the'})
+        self.assertEqual([book['title'] for book in response.data], ['The Silmarillion'])
+        response = self.client.get(url, {'q': 'pro', 'field': 'author', 'limit': 2})
+        self.assertEqual(response.data, [{'author': 'Prolific Author'}, {'author': 'Proust'}])
+
+    def test_list_rendering_matches_serializers(self):
+        """
+        Test case for the values() rendering of list responses.
+        Verifies that books, favorites and reviews render exactly like their serializers.
+        """
+        user = self.create_user()
+        book = BookFactory(created_by=user)
+        review = ReviewFactory(book=book, rating=4)
+        BookRating.objects.record_review(book.id, 4)
+        FavoriteFactory(user=user, book=book)
+        book = Book.objects.select_related('created_by', 'rating_stats').get(id=book.id)
+
+        response = self.client.get('/book/')
+        self.assertEqual(response.data['results'], [BookSerializer(book).data])
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/book/my_favorites/')
+        self.assertEqual(response.data['results'], [{'book': book.id}])
+
+        response = self.client.get('/review/')
+        self.assertEqual(response.data['results'], [ReviewSerializer(review).data])
+
+    def test_msgpack_content_negotiation(self):
+        """
+        Test case for the MessagePack renderer and parser.
+        Verifies that:
+        1. Clients asking for application/msgpack get a msgpack body, others JSON.
+        2. A book can be created from a msgpack request body.
+        """
+        book = BookFactory()
+        response = self.client.get(f'/book/{book.id}/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['title'], book.title)
+
+        response = self.client.get(f'/book/{book.id}/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content)['title'], book.title)
+
+        self.client.force_authenticate(user=self.create_user())
+        data = {'title': 'Packed', 'author': 'Author', 'description': 'Sent as msgpack'}
+        response = self.client.post(
+            '/book/', msgpack.packb(data), content_type='application/msgpack', HTTP_ACCEPT='application/msgpack'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(msgpack.unpackb(response.content)['title'], 'Packed')
+
+        response = self.client.post('/book/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_conditional_get(self):
+        """
+        Test case for ETag and Last-Modified validation.
+        Verifies that:
+        1. An unchanged book detail or list is answered with 304 and no body.
+        2. A committed review changes the validators of both.
+        3. A committed favorite moves the Last-Modified of the detail.
+        4. A deleted review and a new username of the creator change the validators.
+        """
+        book = BookFactory()
+        url = f'/book/{book.id}/'
+        response = self.client.get(url)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        list_etag = self.client.get('/book/')['ETag']
+        self.assertEqual(self.client.get('/book/', HTTP_IF_NONE_MATCH=list_etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        # Another page or format is another representation
+        self.assertNotEqual(self.client.get('/book/', {'page_size': 1})['ETag'], list_etag)
+
+        self.client.force_authenticate(user=self.create_user())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/review/', {'book': book.id, 'rating': 3, 'review_text': 'Fine'})
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['reviews']), 1)
+        response = self.client.get('/book/', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Last-Modified has one second precision, move the other writes out of the way
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        Book.objects.filter(pk=book.pk).update(updated_at=an_hour_ago)
+        BookRating.objects.filter(book=book).update(updated_at=an_hour_ago)
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            FavoriteFactory(book=book)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['favorite_count'], 1)
+
+        Book.objects.filter(pk=book.pk).update(favorites_updated_at=an_hour_ago)
+        last_modified = self.client.get(url)['Last-Modified']
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.get(book=book).delete()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['reviews'], [])
+
+        BookRating.objects.filter(book=book).update(updated_at=an_hour_ago)
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        list_etag = self.client.get('/book/')['ETag']
+        book.created_by.username = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            book.created_by.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created_by']['username'], 'renamed')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/book/', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['created_by']['username'], 'renamed')
+
+    def test_bulk_import(self):
+        """
+        Test case for the bulk import of books.
+        Verifies that:
+        1. Only admins can import and the body must be CSV or NDJSON.
+        2. Valid rows are created and rejected rows are reported by number.
+        3. Imported books are searchable in the autocomplete index.
+        4. A body that stops decoding as UTF-8 is rejected with the report of the rows loaded before it.
+        """
+        url = '/book/import/'
+        body = (
+            'title,author,description\n'
+            'Dune,Frank Herbert,"Spice, sand\nand worms"\n'
+            ',Nobody,Missing title\n'
+            'Emma,Jane Austen,A matchmaker\n'
+        )
+        self.client.force_authenticate(user=self.create_user())
+        response = self.client.post(url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = self.create_user()
+        admin.is_staff = True
+        admin.save()
+        self.client.force_authenticate(user=admin)
+        response = self.client.post(url, body, content_type='application/xml')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(response.data['errors'][0]['row'], 2)
+        self.assertIn('title', response.data['errors'][0]['errors'])
+        dune = Book.objects.get(title='Dune')
+        self.assertEqual(dune.description, 'Spice, sand\nand worms')
+        self.assertEqual(dune.created_by, admin)
+
+        body = '{"title": "Persuasion", "author": "Jane Austen", "description": "Second chances"}\nnot json\n'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, body, content_type='application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+
+        response = self.client.get('/book/autocomplete/', {'q': 'jane', 'field': 'author'})
+        self.assertEqual(response.data, [{'author': 'Jane Austen'}])
+        response = self.client.get('/book/autocomplete/', {'q': 'pers'})
+        self.assertEqual([book['title'] for book in response.data], ['Persuasion'])
+
+        body = 'title,author,description\nLolita,Vladimir Nabokov,Light of my life\nBad,Bytes,\xff\n'.encode('latin-1')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 0))
+        self.assertIn('row 1', response.data['msg'])
+        self.assertTrue(Book.objects.filter(title='Lolita').exists())
+        self.assertFalse(Book.objects.filter(title='Bad').exists())
+
+    def test_export_books(self):
+        """
+        Test case for the streaming book export.
+        Verifies that:
+        1. Active books are streamed as NDJSON by default and as CSV with ?type=csv.
+        2. The body is gzipped when the client accepts it, gzip;q=0 refuses it.
+        3. An unknown type is rejected.
+        4. CSV cells a spreadsheet would run as a formula are prefixed with a quote.
+        """
+        books = BookFactory.create_batch(3)
+        BookFactory(is_active=False)
+        url = '/book/export/'
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [book.id for book in books])
+        self.assertEqual(rows[0]['created_by_username'], books[0].created_by.username)
+        self.assertEqual(rows[0]['rating_stats_review_count'], None)
+
+        response = self.client.get(url, {'type': 'csv'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual([row['title'] for row in rows], [book.title for book in books])
+
+        for accept_encoding in ('gzip;q=0, deflate', 'br, *;q=0', 'identity'):
+            response = self.client.get(url, {'type': 'csv'}, HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertNotIn('Content-Encoding', response)
+        response = self.client.get(url, {'type': 'csv'}, HTTP_ACCEPT_ENCODING='br;q=1.0, *;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        Book.objects.filter(pk=books[0].pk).update(title='=HYPERLINK("http://example.com")', author='-Anon')
+        response = self.client.get(url, {'type': 'csv'})
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual((rows[0]['title'], rows[0]['author']), ('\'=HYPERLINK("http://example.com")', "'-Anon"))
+
+        response = self.client.get(url, {'type': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_favorites_batch(self):
+        """
+        Test case for adding and removing favorites in one request.
+        Verifies that:
+        1. New, already favorited and unknown or inactive books are reported apart.
+        2. Removed books are no longer in the favorites.
+        3. A book can not be added and removed at once.
+        """
+        user = self.create_user()
+        books = BookFactory.create_batch(3)
+        inactive = BookFactory(is_active=False)
+        FavoriteFactory(user=user, book=books[0])
+        self.client.force_authenticate(user=user)
+        url = '/book/favorites/batch/'
+
+        data = {'add': [books[0].id, books[1].id, inactive.id, books[2].id + 1000], 'remove': [books[2].id]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'added': [books[1].id],
+            'already_favorited': [books[0].id],
+            'not_found': [inactive.id, books[2].id + 1000],
+            'removed': [],
+        })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'remove': [books[0].id, books[1].id]}, format='json')
+        self.assertEqual(response.data['removed'], [books[0].id, books[1].id])
+        self.assertFalse(Favorite.objects.filter(user=user).exists())
+
+        response = self.client.post(url, {'add': [books[0].id], 'remove': [books[0].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_is_favorited_and_favorite_count(self):
+        """
+        Test case for the favorite annotations of book responses.
+        Verifies that:
+        1. Books carry their favorite count and whether the requesting user favorited them.
+        2. The favorite set of the user follows favorite and unfavorite without new queries.
+        """
+        user = self.create_user()
+        book, other_book = BookFactory(), BookFactory()
+        FavoriteFactory(book=book)
+        self.client.force_authenticate(user=user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/book/{book.id}/favorite/')
+        response = self.client.get('/book/')
+        results = {row['id']: row for row in response.data['results']}
+        self.assertEqual((results[book.id]['favorite_count'], results[book.id]['is_favorited']), (2, True))
+        self.assertEqual((results[other_book.id]['favorite_count'], results[other_book.id]['is_favorited']), (0, False))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/book/{book.id}/unfavorite/')
+            self.client.post(f'/book/{other_book.id}/favorite/')
+        # The set was loaded by the list above and updated in place, only the book and its reviews are queried
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/book/{other_book.id}/')
+        self.assertEqual((response.data['favorite_count'], response.data['is_favorited']), (1, True))
+        response = self.client.get(f'/book/{book.id}/')
+        self.assertEqual((response.data['favorite_count'], response.data['is_favorited']), (1, False))
+
+        self.client.force_authenticate(user=None)
+        response = self.client.get(f'/book/{other_book.id}/')
+        self.assertFalse(response.data['is_favorited'])
+
+    def test_favorite_set_load_race(self):
+        """
+        Test case for a favorite committed while the favorite set is loaded.
+        Verifies that:
+        1. The ids queried before the favorite are not loaded into the set.
+        2. The next read loads the set again and finds the favorite.
+        """
+        user = self.create_user()
+        book = BookFactory()
+        load_set = favorites._load_set
+
+        def load_after_favorite(user_id, book_ids, version):
+            # The update of the favorite is skipped, the set is not loaded yet
+            with self.captureOnCommitCallbacks(execute=True):
+                Favorite.objects.add_books(user.id, [book.id])
+            load_set(user_id, book_ids, version)
+
+        with patch('apps.book.favorites._load_set', load_after_favorite):
+            self.assertEqual(favorites.get_favorite_ids(user), set())
+        self.assertEqual(favorites.get_favorite_ids(user), {book.id})
+
+    def test_update_keeps_concurrent_favorites(self):
+        """
+        Test case for a book update racing a favorite.
+        Verifies that:
+        1. A favorite committed after the book was loaded keeps its count once the update saves.
+        2. Soft deleting the book keeps the count as well.
+        3. The update neither loads nor writes the search vector, the trigger keeps it.
+        """
+        user = self.create_user()
+        book = BookFactory(created_by=user)
+        update = BookSerializer.update
+
+        def update_after_favorite(serializer, instance, validated_data):
+            # The instance was loaded before the favorite, like a request running alongside it
+            FavoriteFactory(book=instance)
+            return update(serializer, instance, validated_data)
+
+        self.client.force_authenticate(user=user)
+        with patch.object(BookSerializer, 'update', update_after_favorite), \
+                CaptureQueriesContext(connections['default']) as queries:
+            response = self.client.patch(f'/book/{book.id}/', {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'search_vector' in query['sql']])
+        self.assertTrue(Book.objects.filter(pk=book.pk, search_vector='renamed').exists())
+        book.refresh_from_db()
+        self.assertEqual((book.title, book.favorite_count), ('Renamed', 1))
+
+        stale = Book.objects.get(pk=book.pk)
+        FavoriteFactory(book=book)
+        stale.is_active = False
+        stale.save()
+        book.refresh_from_db()
+        self.assertEqual((book.is_active, book.favorite_count), (False, 2))
+
+    def test_my_favorites_feed(self):
+        """
+        Test case for the expanded my_favorites feed.
+        Verifies that:
+        1. Each favorite carries a summary of its active book, newest favorite first.
+        2. A page costs one query whatever its size.
+        """
+        user = self.create_user()
+        books = BookFactory.create_batch(4)
+        for book in books:
+            FavoriteFactory(user=user, book=book)
+        BookRating.objects.record_review(books[0].id, 4)
+        books[1].is_active = False
+        books[1].save()
+        self.client.force_authenticate(user=user)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/book/my_favorites/', {'expand': 'book', 'page_size': 2})
+        self.assertEqual([row['book']['id'] for row in response.data['results']], [books[3].id, books[2].id])
+        with self.assertNumQueries(1):
+            response = self.client.get(response.data['next'])
+        feed_book = response.data['results'][0]['book']
+        self.assertEqual(feed_book['id'], books[0].id)
+        self.assertEqual(feed_book['created_by']['username'], books[0].created_by.username)
+        self.assertEqual((feed_book['average_rating'], feed_book['review_count']), (4.0, 1))
+        self.assertTrue(feed_book['is_favorited'])
+
+    def test_batch_books(self):
+        """
+        Test case for retrieving many books by id.
+        Verifies that:
+        1. Books are returned in the requested order, unknown and inactive ids are reported.
+        2. A second request is served from the cache without any query.
+        3. A write to one book refreshes only that book.
+        """
+        books = BookFactory.create_batch(3)
+        inactive = BookFactory(is_active=False)
+        url = '/book/batch/'
+        ids = f'{books[2].id},{books[0].id},{inactive.id},{books[1].id}'
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'ids': ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([book['id'] for book in response.data['results']], [books[2].id, books[0].id, books[1].id])
+        self.assertEqual(response.data['not_found'], [inactive.id])
+
+        with self.assertNumQueries(1):
+            # Only the inactive book is looked up again
+            response = self.client.get(url, {'ids': ids})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'ids': f'{books[0].id},{books[1].id}'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            books[0].title = 'Renamed'
+            books[0].save()
+        response = self.client.get(url, {'ids': f'{books[0].id},{books[1].id}'})
+        self.assertEqual(response.data['results'][0]['title'], 'Renamed')
+
+        response = self.client.get(url, {'ids': 'a,b'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_leaderboards(self):
+        """
+        Test case for the redis leaderboards.
+        Verifies that:
+        1. The rating board ranks by Bayesian average, many 4.8s beat a single 5.
+        2. The favorites, trending and windowed boards follow reviews and favorites.
+        3. A warm board is served without queries and soft deleted books leave it.
+        4. A windowed board serves its last sum until it is due to be summed again.
+        5. Soft deleted books stay off every board through later reviews and favorites.
+        """
+        single, popular, poor = BookFactory.create_batch(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            ReviewFactory(book=single, rating=5)
+            for rating in [5] * 16 + [4] * 4:
+                ReviewFactory(book=popular, rating=rating)
+            for _ in range(10):
+                ReviewFactory(book=poor, rating=1)
+            FavoriteFactory.create_batch(2, book=single)
+            FavoriteFactory(book=popular)
+        url = '/book/leaderboard/'
+
+        def ranking(**params):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [book['id'] for book in response.data['results']]
+
+        self.assertEqual(ranking(), [popular.id, single.id, poor.id])
+        self.assertEqual(ranking(board='rating', window='7d', limit=2), [popular.id, single.id])
+        self.assertEqual(ranking(board='favorites'), [single.id, popular.id])
+        self.assertEqual(ranking(board='favorites', window='30d'), [single.id, popular.id])
+        self.assertEqual(ranking(board='trending'), [popular.id, poor.id, single.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(ranking(), [popular.id, single.id, poor.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FavoriteFactory.create_batch(2, book=popular)
+        self.assertEqual(ranking(board='favorites', window='30d'), [single.id, popular.id])
+        get_redis_connection('default').delete('leaderboard:favorites:30d:fresh')
+        self.assertEqual(ranking(board='favorites', window='30d'), [popular.id, single.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            popular.is_active = False
+            popular.save()
+        self.assertEqual(ranking(), [single.id, poor.id])
+        self.assertEqual(ranking(board='favorites', window='30d'), [single.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ReviewFactory(book=popular, rating=5)
+            FavoriteFactory(book=popular)
+        get_redis_connection('default').delete('leaderboard:rating:7d:fresh', 'leaderboard:favorites:30d:fresh')
+        self.assertEqual(ranking(limit=2), [single.id, poor.id])
+        self.assertEqual(ranking(board='rating', window='7d', limit=2), [single.id, poor.id])
+        self.assertEqual(ranking(board='favorites'), [single.id])
+        self.assertEqual(ranking(board='favorites', window='30d'), [single.id])
+        self.assertNotIn(popular.id, ranking(board='trending'))
+
+        # Factories skip the stats the review API keeps
+        call_command('reconcile_rating_stats', stdout=io.StringIO())
+        call_command('rebuild_leaderboards', stdout=io.StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            ReviewFactory(book=popular, rating=5)
+        self.assertEqual(ranking(), [single.id, poor.id])
+
+        response = self.client.get(url, {'board': 'trending', 'window': '7d'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_async_read_views(self):
+        """
+        Test case for the async read endpoints.
+        Verifies that:
+        1. Book list, detail, top rated and review list answer the same as their sync views.
+        2. A current ETag gets a 304, a missing book a 404 and an anonymous review list a 401.
+        """
+        book = BookFactory()
+        for rating in (5, 4):
+            ReviewFactory(book=book, rating=rating)
+            BookRating.objects.record_review(book.id, rating)
+        user = self.create_user()
+        FavoriteFactory(user=user, book=book)
+        # A token is created with every user
+        token = Token.objects.get(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        get = async_to_sync(self.async_client.get)
+        headers = {'Authorization': f'Token {token.key}'}
+
+        for path in ('', f'{book.id}/', 'top-10-rated/'):
+            response = get(f'/book/async/{path}', headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), self.client.get(f'/book/{path}').json())
+        response = get('/review/async/', {'book': book.id}, headers=headers)
+        self.assertEqual(response.json(), self.client.get('/review/', {'book': book.id}).json())
+        self.assertEqual(len(response.json()['results']), 2)
+
+        response = get(f'/book/async/{book.id}/', headers=headers)
+        self.assertTrue(response.json()['is_favorited'])
+        # Neither a 304 nor a 404 pages the reviews
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = get(f'/book/async/{book.id}/', headers={**headers, 'If-None-Match': response['ETag']})
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(get('/book/async/0/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(queries)
+        self.assertFalse([query for query in queries if 'FROM "review_review"' in query['sql']])
+        self.assertEqual(get('/review/async/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_request_metrics(self):
+        """
+        Test case for the per request instrumentation.
+        Verifies that:
+        1. Responses carry a Server-Timing header with the SQL queries and cache hits and misses.
+        2. /metrics reports per route histograms, to staff only.
+        """
+        book = BookFactory()
+        ReviewFactory.create_batch(3, book=book)
+
+        response = self.client.get(f'/book/{book.id}/')
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        response = self.client.get('/book/top-10-rated/')
+        self.assertIn('cache;desc="0 hits, 1 misses"', response['Server-Timing'])
+        response = self.client.get('/book/top-10-rated/')
+        self.assertIn('cache;desc="1 hits, 0 misses"', response['Server-Timing'])
+
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(user=UserFactory(is_staff=True))
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_sql_queries histogram', body)
+        self.assertIn('http_request_sql_queries_bucket{route="book-detail",method="GET",le="2"} ', body)
+        self.assertIn('http_request_cache_misses_total{route="book-top-rated",method="GET"} ', body)
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0, SLOW_QUERY_SAMPLE_RATE=1)
+    def test_slow_query_log(self):
+        """
+        Test case for the slow query log.
+        Verifies that:
+        1. A slow query is kept with its parameters, request and EXPLAIN ANALYZE plan.
+        2. The same statement is explained once per cooldown.
+        3. A write hidden in a CTE gets its plan without being run again.
+        4. Staff read the log through the management command, which can empty it.
+        """
+        book = BookFactory(title='Dune')
+        self.client.get('/book/', {'title': 'dune'})
+        self.client.get('/book/', {'title': 'dune'})
+        self.client.force_authenticate(user=self.create_user())
+        self.client.post(f'/book/{book.id}/favorite/')
+
+        entries = [entry for entry in get_slow_queries() if entry['view'] == 'book-list']
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['path'], 'GET /book/?title=dune')
+        self.assertIn('%dune%', entries[0]['params'])
+        self.assertIn('Execution Time', entries[0]['plan'])
+
+        favorite, = [entry for entry in get_slow_queries() if 'INSERT INTO book_favorite' in entry['sql']]
+        self.assertIn('Insert on book_favorite', favorite['plan'])
+        self.assertNotIn('Execution Time', favorite['plan'])
+
+        out = io.StringIO()
+        call_command('slow_queries', '--clear', stdout=out)
+        self.assertIn('book-list', out.getvalue())
+        self.assertEqual(get_slow_queries(), [])
+
+
+class TestReplicaRouting(APITransactionTestCase):
+    # Committed rows, so the replica alias reads them through its own connection
+    databases = {'default', 'replica_1'}
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        local_cache.clear()
+
+    def get_book(self, book, user):
+        # Returns the book queries run on the primary and on the replica
+        token = Token.objects.get(user=user)
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica_1']) as replica:
+            response = self.client.get(f'/book/{book.id}/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [
+            [query['sql'] for query in queries if 'FROM "book_book"' in query['sql']]
+            for queries in (primary, replica)
+        ]
+
+    def test_read_replica_routing(self):
+        """
+        Test case for routing reads to the replicas.
+        Verifies that:
+        1. A read only request reads from the replica.
+        2. After a write the same client reads from the primary, other clients still use the replica.
+        """
+        book = BookFactory()
+        writer, reader = UserFactory(), UserFactory()
+
+        primary, replica = self.get_book(book, writer)
+        self.assertEqual((len(primary), len(replica)), (0, 1))
+
+        token = Token.objects.get(user=writer)
+        response = self.client.post(f'/book/{book.id}/favorite/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        primary, replica = self.get_book(book, writer)
+        self.assertEqual((len(primary), len(replica)), (1, 0))
+        primary, replica = self.get_book(book, reader)
+        self.assertEqual((len(primary), len(replica)), (0, 1))
+
+    def test_replica_lag_does_not_reach_shared_caches(self):
+        """
+        Test case for a replica that has not caught up with a write.
+        Verifies that:
+        1. Cached summaries and favorite sets are filled from the primary, not from the old rows.
+        2. A list read from the replica while the write is recent has no ETag.
+        """
+        writer, reader = UserFactory(), UserFactory()
+        book = BookFactory(created_by=writer, title='Old')
+        headers = {
+            user: {'HTTP_AUTHORIZATION': f'Token {Token.objects.get(user=user).key}'} for user in (writer, reader)
+        }
+
+        # The replica keeps reading the snapshot taken here, as if replication stopped
+        replica = connections['replica_1']
+        replica.ensure_connection()
+        with replica.connection.cursor() as cursor:
+            cursor.execute('BEGIN ISOLATION LEVEL REPEATABLE READ')
+            cursor.execute('SELECT count(*) FROM book_book')
+        try:
+            response = self.client.patch(f'/book/{book.id}/', {'title': 'New'}, format='json', **headers[writer])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # Outside a request, the reader does not stick to the primary
+            Favorite.objects.add_books(reader.id, [book.id])
+
+            response = self.client.get('/book/', **headers[reader])
+            self.assertEqual(response.data['results'][0]['title'], 'Old')
+            self.assertNotIn('ETag', response)
+            response = self.client.get('/book/batch/', {'ids': book.id}, **headers[reader])
+            self.assertEqual(
+                (response.data['results'][0]['title'], response.data['results'][0]['is_favorited']), ('New', True)
+            )
+        finally:
+            with replica.connection.cursor() as cursor:
+                cursor.execute('ROLLBACK')
+
+
+class TestConcurrentFavorites(APITransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        local_cache.clear()
+
+    def test_concurrent_favorite_returns_its_id(self):
+        """
+        Test case for favoriting a book while another transaction favorites it for the same user.
+        Verifies that:
+        1. The statement waits for the other insert and reports the book as not created.
+        2. The favorite id of the other insert is returned instead of None.
+        """
+        user, book = UserFactory(), BookFactory()
+        other = connections.create_connection('default')
+        other.ensure_connection()
+        added = {}
+
+        def add():
+            try:
+                added.update(Favorite.objects.add_books(user.id, [book.id]))
+            finally:
+                connections['default'].close()
+
+        try:
+            with other.connection.cursor() as cursor:
+                cursor.execute('BEGIN')
+                cursor.execute(
+                    'INSERT INTO book_favorite (user_id, book_id, created_at) VALUES (%s, %s, now()) RETURNING id',
+                    [user.id, book.id],
+                )
+                favorite_id = cursor.fetchone()[0]
+                thread = threading.Thread(target=add)
+                thread.start()
+                # Wait for the insert of the thread to block on the conflicting row
+                for _ in range(500):
+                    cursor.execute("SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'")
+                    if cursor.fetchone()[0]:
+                        break
+                    time.sleep(0.01)
+                cursor.execute('COMMIT')
+            thread.join()
+        finally:
+            other.close()
+        self.assertEqual(added, {book.id: (favorite_id, False)})
@@ -3,9 +3,14 @@ from django.urls import path,include
 from rest_framework.routers import DefaultRouter
 
 from apps.book.views import BookViewSet
+from apps.book.async_views import AsyncBookListView, AsyncBookDetailView, AsyncTopRatedView
 
 router = DefaultRouter()
 router.register(r'', BookViewSet, basename='book')
 urlpatterns = [
+        # Served on the event loop when the project runs under ASGI
+        path('async/', AsyncBookListView.as_view(), name='book-async-list'),
+        path('async/top-10-rated/', AsyncTopRatedView.as_view(), name='book-async-top-rated'),
+        path('async/<int:pk>/', AsyncBookDetailView.as_view(), name='book-async-detail'),
         path('', include(router.urls)),
 ]
@@ -1,41 +1,196 @@
-from django.db.models import Avg
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
 from django_filters.rest_framework import DjangoFilterBackend
 
 from rest_framework import viewsets,status
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 
 from apps.book.models import Book,Favorite
-from apps.review.models import Review
+from apps.review.models import Review, BookRating
 from apps.review.serializer import ReviewSerializer
-from apps.book.cache import top_book_cache
+from apps.book import autocomplete, leaderboards
+from apps.book.favorites import get_favorite_ids
+from apps.book.cache import get_or_fill, get_many_or_fill, get_validator_versions
 from apps.book.filters import BookFilter
+from apps.book.importer import IMPORT_FORMATS, read_rows, import_books
+from apps.book.hydration import with_book_relations, hydrate_books
+from apps.book.rendering import (
+    BOOK_EXPORT_COLUMNS,
+    FAVORITE_EXPORT_COLUMNS,
+    book_values,
+    render_book,
+    favorite_values,
+    render_favorite,
+    favorite_feed_values,
+    render_favorite_feed
+    )
+from apps.review.rendering import review_values, render_review
+from config.conditional import ConditionalGetMixin
+from config.exports import export_response
+from config.throttling import RateLimitHeadersMixin, UserRateThrottle
+from config.pagination import EmbeddedReviewPagination, RankedPagination
+from apps.user.models import USERS_UPDATED_KEY
+from apps.user.serializer import UserSummarySerializer
 from apps.book.serializers import (
     BookSerializer,
-    FavoriteSerializer,
-    FavoriteBookSerializer
+    FavoriteBatchSerializer
     )
 
 
-class BookViewSet(viewsets.ModelViewSet):
+# Ids accepted by one batch request
+MAX_BATCH_IDS = 100
+
+
+# Get the books with the highest average rating, limiting to top 10
+def get_top_rated_books():
+    # Invalidated by any book or review write, so the timeout can be long
+    return get_or_fill(
+        'top_10_rated_books',
+        lambda: list(
+            BookRating.objects
+            .filter(review_count__gt=0, book__is_active=True)
+            .order_by('-average_rating', '-review_count')
+            .values('book', avg_rating=F('average_rating'))[:10]
+            ),
+        timeout=60*60*24,
+        tags=('books', 'reviews', 'users')
+        )
+
+
+def serialize_top_rated(books, average_ratings, context):
+    # The books come with their reviews prefetched, serializing them does not query
+    top_rated_books_list = []
+    for book in books:
+        book_data = BookSerializer(book, context=context).data
+        book_data['average_rating'] = average_ratings[book.id]
+        book_data['reviews'] = ReviewSerializer(book.review_set.all(), many=True).data
+        top_rated_books_list.append(book_data)
+    return top_rated_books_list
+
+
+class BookViewSet(RateLimitHeadersMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Book.objects.filter(is_active=True)
     serializer_class = BookSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = BookFilter
+    # Only the favorite actions set throttle_classes, this scope is theirs
+    throttle_scope = 'favorite'
+    lookup_value_regex = r'\d+'
+    # is_favorited depends on who is asking
+    vary_headers = ('Accept', 'Authorization')
+
+    @property
+    def paginator(self):
+        # Ranked search results have no created_at order for the cursor to walk
+        if not hasattr(self, '_paginator'):
+            request = getattr(self, 'request', None)
+            if request is not None and request.query_params.get('q'):
+                self._paginator = RankedPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
+    def get_queryset(self):
+        return with_book_relations(super().get_queryset())
+
+    @property
+    def favorite_ids(self):
+        # Book ids favorited by the requesting user, read once per request from redis
+        if not hasattr(self, '_favorite_ids'):
+            self._favorite_ids = get_favorite_ids(self.request.user)
+        return self._favorite_ids
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['favorite_ids'] = self.favorite_ids
+        return context
+
+    def list(self, request, *args, **kwargs):
+        # Any book, review, favorite or user write bumps these versions, no query needed to validate
+        versions = get_validator_versions(('books', 'reviews', 'favorites', 'users'))
+        etag = self.get_etag(request, request.user.pk, *versions.values()) if versions else None
+        not_modified = self.not_modified_response(request, etag)
+        if not_modified:
+            return not_modified
+
+        # Rendered straight from values() rows, the joins come from the values themselves
+        queryset = self.filter_queryset(super().get_queryset())
+        page = self.paginate_queryset(book_values(queryset))
+        results = [render_book(row, self.favorite_ids) for row in page]
+        return self.set_validators(self.get_paginated_response(results), etag)
+
+    # Summaries of many books by id, each cached on its own and invalidated with its book
+    @action(
+            detail=False,
+            methods=['get']
+            )
+    def batch(self, request):
+        ids = request.query_params.get('ids', '').split(',')
+        try:
+            book_ids = list(dict.fromkeys(int(book_id) for book_id in ids if book_id))
+        except ValueError:
+            return Response({'msg': 'ids must be a comma separated list of numbers.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not book_ids or len(book_ids) > MAX_BATCH_IDS:
+            return Response({'msg': f'Pass between 1 and {MAX_BATCH_IDS} ids.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        summaries = self.get_book_summaries(book_ids)
+        results = [summaries[book_id] for book_id in book_ids if book_id in summaries]
+        not_found = [book_id for book_id in book_ids if book_id not in summaries]
+        return Response({'results': results, 'not_found': not_found}, status=status.HTTP_200_OK)
+
+    def get_book_summaries(self, book_ids):
+        """
+        Return {book_id: summary} of the active books among book_ids, from redis when cached.
+        """
+        summaries = get_many_or_fill(
+            [f'book_summary:{book_id}' for book_id in book_ids],
+            self.fill_book_summaries,
+            timeout=60*60,
+            tags=lambda key: (f'book:{key.rsplit(":", 1)[1]}', 'users')
+            )
+        # Cached for every user, is_favorited is set per request
+        return {
+            summary['id']: dict(summary, is_favorited=summary['id'] in self.favorite_ids)
+            for summary in summaries.values()
+        }
+
+    def fill_book_summaries(self, keys):
+        book_ids = [int(key.rsplit(':', 1)[1]) for key in keys]
+        rows = book_values(super().get_queryset().filter(id__in=book_ids))
+        return {f'book_summary:{row["id"]}': render_book(row) for row in rows}
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
+        # Review writes bump the updated_at of the rating stats, favorite writes favorites_updated_at
+        # and username or email changes USERS_UPDATED_KEY, validate before loading the reviews
+        stats = getattr(instance, 'rating_stats', None)
+        versions = (
+            instance.updated_at, stats.updated_at if stats else None, instance.favorites_updated_at,
+            cache.get(USERS_UPDATED_KEY),
+        )
+        favorite = (instance.favorite_count, request.user.pk, instance.pk in self.favorite_ids)
+        etag = self.get_etag(request, instance.pk, *versions, *favorite)
+        last_modified = max(version for version in versions if version)
+        not_modified = self.not_modified_response(request, etag, last_modified)
+        if not_modified:
+            return not_modified
+
         serializer = self.get_serializer(instance)
-        reviews = Review.objects.filter(book=instance)
-        review_serializer = ReviewSerializer(reviews, many=True)
-        # Calculate the average rating for the book
-        average_rating = reviews.aggregate(avg_rating=Avg('rating'))['avg_rating']
-        
+        # Embed one page of reviews, the next ones are fetched with ?reviews_cursor=
+        review_paginator = EmbeddedReviewPagination()
+        reviews = review_paginator.paginate_queryset(
+            review_values(Review.objects.filter(book=instance)), request, view=self
+            )
+        # Rating stats are maintained on every review write, no aggregation needed
         response_data = serializer.data
-        response_data['average_rating'] = average_rating
-        response_data['reviews'] = review_serializer.data
-        return Response(response_data)
+        response_data['rating_histogram'] = stats.histogram if stats else None
+        response_data['reviews'] = [render_review(row) for row in reviews]
+        response_data['reviews_next'] = review_paginator.get_next_link()
+        return self.set_validators(Response(response_data), etag, last_modified)
     
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -55,37 +210,56 @@ class BookViewSet(viewsets.ModelViewSet):
     @action(
             detail=True, 
             methods=['post'], 
-            permission_classes=[IsAuthenticated]
+            permission_classes=[IsAuthenticated],
+            throttle_classes=[UserRateThrottle]
             )
     def favorite(self, request, pk=None):
-        book = self.get_object()
-        data = {'book': book.id, 'user': request.user.id}
-        serializer = FavoriteSerializer(
-                data=data,
-                context={'request': request
-                })
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # Idempotent, favoriting a book again answers with the existing favorite
+        book_id = int(pk)
+        favorites = Favorite.objects.add_books(request.user.id, [book_id])
+        if book_id not in favorites:
+            raise NotFound()
+        favorite_id, created = favorites[book_id]
+        data = {'id': favorite_id, 'user': UserSummarySerializer(request.user).data, 'book': book_id}
+        return Response(data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
     
     @action(
             detail=True, 
             methods=['delete'], 
-            permission_classes=[IsAuthenticated]
+            permission_classes=[IsAuthenticated],
+            throttle_classes=[UserRateThrottle]
             )
     def unfavorite(self, request, pk=None):
-        book = self.get_object()
-        user = request.user
-        favorite = Favorite.objects.filter(book=book, user=user)
-        if favorite.exists():
-            favorite.delete()
+        if Favorite.objects.remove_books(request.user.id, [int(pk)]):
             return Response({
                 'msg': 'Book removed from favorites successfully.'}, 
                 status=status.HTTP_200_OK)
         return Response({
             'msg': 'You have not favorited this book.'}, 
             status=status.HTTP_400_BAD_REQUEST)
+
+    # Adds and removes up to a thousand favorites each with one statement per direction
+    @action(
+            detail=False,
+            methods=['post'],
+            url_path='favorites/batch',
+            permission_classes=[IsAuthenticated],
+            throttle_classes=[UserRateThrottle]
+            )
+    def favorites_batch(self, request):
+        serializer = FavoriteBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        add, remove = serializer.validated_data['add'], serializer.validated_data['remove']
+        with transaction.atomic():
+            favorites = Favorite.objects.add_books(request.user.id, add) if add else {}
+            removed = set(Favorite.objects.remove_books(request.user.id, remove)) if remove else set()
+        return Response({
+            'added': [book_id for book_id in add if book_id in favorites and favorites[book_id][1]],
+            'already_favorited': [book_id for book_id in add if book_id in favorites and not favorites[book_id][1]],
+            'not_found': [book_id for book_id in add if book_id not in favorites],
+            'removed': [book_id for book_id in remove if book_id in removed],
+        }, status=status.HTTP_200_OK)
     
     
     @action(
@@ -94,9 +268,13 @@ class BookViewSet(viewsets.ModelViewSet):
             permission_classes=[IsAuthenticated]
             )
     def my_favorites(self, request):  
-        favorites = Favorite.objects.filter(user=request.user)  
-        serializer = FavoriteBookSerializer(favorites, many=True)
-        return Response(serializer.data,status=status.HTTP_200_OK)
+        queryset = Favorite.objects.filter(user=request.user)
+        # ?expand=book returns a feed of book summaries, joined in the page query
+        if request.query_params.get('expand') == 'book':
+            favorites = self.paginate_queryset(favorite_feed_values(queryset.filter(book__is_active=True)))
+            return self.get_paginated_response([render_favorite_feed(row) for row in favorites])
+        favorites = self.paginate_queryset(favorite_values(queryset))
+        return self.get_paginated_response([render_favorite(row) for row in favorites])
     
 
 
@@ -104,34 +282,94 @@ class BookViewSet(viewsets.ModelViewSet):
 
 
 
-    # Get the books with the highest average rating, limiting to top 10
-    def get_top_rated_books(self):
-        return Review.objects.values('book').annotate(avg_rating=Avg('rating')).order_by('-avg_rating')[:10]
-    
+    # Streams the filtered catalog as NDJSON or CSV without loading it in memory
+    @action(
+            detail=False,
+            methods=['get']
+            )
+    def export(self, request):
+        queryset = self.filter_queryset(Book.objects.filter(is_active=True)).order_by('id')
+        return export_response(request, queryset, BOOK_EXPORT_COLUMNS, 'books')
+
+    @action(
+            detail=False,
+            methods=['get'],
+            url_path='my_favorites/export',
+            permission_classes=[IsAuthenticated]
+            )
+    def export_favorites(self, request):
+        queryset = Favorite.objects.filter(user=request.user).order_by('id')
+        return export_response(request, queryset, FAVORITE_EXPORT_COLUMNS, 'favorites')
+
+    # Streams a CSV or NDJSON body into the catalog, the body is read line by line and never parsed as a whole
+    @action(
+            detail=False,
+            methods=['post'],
+            url_path='import',
+            permission_classes=[IsAdminUser]
+            )
+    def bulk_import(self, request):
+        fmt = IMPORT_FORMATS.get(request.content_type.split(';')[0].strip())
+        if fmt is None:
+            return Response(
+                {'msg': f'Content type must be one of {", ".join(IMPORT_FORMATS)}.'},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        lines = (line.decode('utf-8') for line in request.stream or ())
+        report = import_books(read_rows(lines, fmt), request.user)
+        # Batches loaded before an undecodable line stay committed, the report says what they were
+        return Response(report, status=status.HTTP_400_BAD_REQUEST if 'msg' in report else status.HTTP_200_OK)
+
+    @action(
+            detail=False,
+            methods=['get']
+            )
+    def autocomplete(self, request):
+        field = request.query_params.get('field', 'title')
+        if field not in autocomplete.AUTOCOMPLETE_FIELDS:
+            return Response({'msg': 'field must be title or author.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 50))
+        except ValueError:
+            return Response({'msg': 'limit must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        completions = autocomplete.complete(field, request.query_params.get('q', ''), limit)
+        return Response(completions, status=status.HTTP_200_OK)
+
+    # Rankings kept in redis sorted sets, a warm board is served without any query
+    @action(
+            detail=False,
+            methods=['get']
+            )
+    def leaderboard(self, request):
+        board = request.query_params.get('board', 'rating')
+        window = request.query_params.get('window') or None
+        if board not in leaderboards.BOARDS:
+            return Response({'msg': f'board must be one of {", ".join(leaderboards.BOARDS)}.'}, status=status.HTTP_400_BAD_REQUEST)
+        if window is not None and (board == 'trending' or window not in leaderboards.WINDOWS):
+            return Response({'msg': 'window must be 7d or 30d, trending has no window.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), MAX_BATCH_IDS)
+        except ValueError:
+            return Response({'msg': 'limit must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ranking = leaderboards.top(board, max(limit, 1), window)
+        summaries = self.get_book_summaries([book_id for book_id, _ in ranking])
+        results = [
+            dict(summaries[book_id], score=score)
+            for book_id, score in ranking
+            if book_id in summaries
+        ]
+        return Response({'board': board, 'window': window, 'results': results}, status=status.HTTP_200_OK)
+
     @action(
             detail=False,
             methods=['get'],
             url_path='top-10-rated'
             )
     def top_rated(self, request):
-        cache_key = 'top_10_rated_books'
-        top_rated_books = top_book_cache(cache_key, self.get_top_rated_books)
-
+        top_rated_books = get_top_rated_books()
         if top_rated_books:
-            top_rated_books_list = []
-            for book_info in top_rated_books:
-                book_id = book_info['book']
-                average_rating = book_info['avg_rating']
-                book = Book.objects.get(id=book_id)
-
-                serializer = self.get_serializer(book)
-                reviews = Review.objects.filter(book=book)
-                review_serializer = ReviewSerializer(reviews, many=True)
-
-                book_data = serializer.data
-                book_data['average_rating'] = average_rating
-                book_data['reviews'] = review_serializer.data
-
-                top_rated_books_list.append(book_data)
-            return Response(top_rated_books_list)
+            # Hydrate every book with its creator, stats and reviews in one batch
+            average_ratings = {book_info['book']: book_info['avg_rating'] for book_info in top_rated_books}
+            books = hydrate_books(list(average_ratings))
+            return Response(serialize_top_rated(books, average_ratings, self.get_serializer_context()))
         return Response({"detail": "No reviews found."}, status=status.HTTP_404_NOT_FOUND)
@@ -1,7 +1,11 @@
 from django.contrib import admin
-from .models import Review
+from .models import Review, BookRating
 
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('id','book', 'user', 'review_text', 'rating','created_at')
 
-admin.site.register(Review,ReviewAdmin)
\ No newline at end of file
+class BookRatingAdmin(admin.ModelAdmin):
+    list_display = ('book', 'review_count', 'average_rating', 'updated_at')
+
+admin.site.register(Review,ReviewAdmin)
+admin.site.register(BookRating,BookRatingAdmin)
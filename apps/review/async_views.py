@@ -0,0 +1,27 @@
+from asgiref.sync import sync_to_async
+
+from rest_framework.permissions import IsAuthenticated
+
+from apps.book.cache import get_validator_versions
+from apps.review.filters import ReviewFilter
+from apps.review.models import Review
+from apps.review.rendering import review_values, render_review
+from config.async_views import AsyncReadView, run_in_thread
+from config.pagination import CreatedAtCursorPagination
+
+
+# Async twin of ReviewViewSet.list
+class AsyncReviewListView(AsyncReadView):
+    permission_classes = [IsAuthenticated]
+    filterset_class = ReviewFilter
+
+    async def get(self, request):
+        versions = await run_in_thread(get_validator_versions, ('reviews', 'users'))
+        etag = self.get_etag(request, *versions.values()) if versions else None
+        not_modified = self.not_modified_response(request, etag)
+        if not_modified:
+            return not_modified
+
+        paginator = CreatedAtCursorPagination()
+        page = await sync_to_async(self.paginate)(Review.objects.all(), paginator, review_values)
+        return self.set_validators(self.paginated_response(paginator, [render_review(row) for row in page]), etag)
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from apps.book.cache import invalidate_tags_on_commit
+from apps.book.models import Book
+from apps.review.models import BookRating
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rating stats of every book from its reviews and repair any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted books.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        repaired = 0
+        last_id = 0
+        while True:
+            book_ids = list(
+                Book.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not book_ids:
+                break
+            last_id = book_ids[-1]
+            repaired += self.reconcile(book_ids, options['dry_run'])
+
+        action = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{action} {repaired} drifted rating stats.'))
+
+    def reconcile(self, book_ids, dry_run):
+        with transaction.atomic():
+            # Locked before counting, a review committed meanwhile waits for us and then adds itself
+            current = {
+                stats.book_id: stats
+                for stats in BookRating.objects.select_for_update().filter(book_id__in=book_ids)
+            }
+            expected = BookRating.objects.compute_from_reviews(book_ids)
+            to_create, to_update = [], []
+            for book_id in book_ids:
+                values = expected.get(book_id)
+                stats = current.get(book_id)
+                if values is None:
+                    # Books without any review only need a row if one already exists
+                    if stats is None:
+                        continue
+                    values = {field: 0 for field in BookRating.STAT_FIELDS}
+                values['average_rating'] = (
+                    values['rating_sum'] / values['review_count'] if values['review_count'] else None
+                )
+                if stats is None:
+                    to_create.append(BookRating(book_id=book_id, **values))
+                elif any(getattr(stats, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(stats, field, value)
+                    stats.updated_at = timezone.now()
+                    to_update.append(stats)
+
+            for stats in to_create + to_update:
+                self.stdout.write(f'Drift in rating stats of book {stats.book_id}')
+            if not dry_run:
+                # A first review may create the row meanwhile, the next run checks that book again
+                BookRating.objects.bulk_create(to_create, ignore_conflicts=True)
+                BookRating.objects.bulk_update(to_update, BookRating.STAT_FIELDS + ('updated_at',))
+                # Bulk writes send no signals, drop the cached entries built from the old stats
+                repaired_ids = [stats.book_id for stats in to_create + to_update]
+                if repaired_ids:
+                    invalidate_tags_on_commit('reviews', *[f'book:{book_id}' for book_id in repaired_ids])
+        return len(to_create) + len(to_update)
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0001_initial'),
+        ('review', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('average_rating', models.FloatField(blank=True, db_index=True, null=True)),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rating_stats', to='book.book')),
+            ],
+        ),
+        # Backfill the stats of already reviewed books
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO review_bookrating (
+                    book_id, review_count, rating_sum, average_rating,
+                    rating_1, rating_2, rating_3, rating_4, rating_5, updated_at
+                )
+                SELECT
+                    book_id, COUNT(*), SUM(rating), AVG(rating)::double precision,
+                    COUNT(*) FILTER (WHERE rating = 1),
+                    COUNT(*) FILTER (WHERE rating = 2),
+                    COUNT(*) FILTER (WHERE rating = 3),
+                    COUNT(*) FILTER (WHERE rating = 4),
+                    COUNT(*) FILTER (WHERE rating = 5),
+                    NOW()
+                FROM review_review
+                GROUP BY book_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,5 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
+from django.db.models import Case, Count, F, FloatField, Q, Sum, When
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
+from django.utils import timezone
+from apps.book import leaderboards
+from apps.book.cache import invalidate_tags_on_commit
 from apps.book.models import Book
 
 class Review(models.Model):
@@ -9,7 +16,114 @@ class Review(models.Model):
     rating = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Keyset pagination of all reviews and of the reviews of a book
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='review_created_idx'),
+            models.Index(fields=['book', '-created_at', '-id'], name='review_book_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s Review  book: {self.book}"
 
 
+# Reviews change the rating stats, drop every cached entry built from them
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_review_cache(sender, instance, **kwargs):
+    invalidate_tags_on_commit('reviews', f'book:{instance.book_id}')
+
+
+@receiver(post_save, sender=Review)
+def rank_saved_review(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: leaderboards.record_review(instance.book_id, instance.rating, instance.created_at))
+
+
+# Reviews deleted by the admin or a cascade leave the stats as well
+@receiver(post_delete, sender=Review)
+def count_deleted_review(sender, instance, **kwargs):
+    BookRating.objects.remove_review(instance.book_id, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def rank_deleted_review(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: leaderboards.record_review(instance.book_id, instance.rating, instance.created_at, removed=True)
+    )
+
+
+class BookRatingManager(models.Manager):
+
+    def record_review(self, book_id, rating):
+        """
+        Add a single rating to the stats of a book. Must run in the same
+        transaction as the review insert so the stats never drift.
+        """
+        self.get_or_create(book_id=book_id)
+        # All F() references read the old row values, so the average is
+        # computed from the updated sum and count in the same statement.
+        self.filter(book_id=book_id).update(
+            review_count=F('review_count') + 1,
+            rating_sum=F('rating_sum') + rating,
+            average_rating=Cast(F('rating_sum') + rating, FloatField()) / (F('review_count') + 1),
+            updated_at=timezone.now(),
+            **{f'rating_{rating}': F(f'rating_{rating}') + 1},
+        )
+
+    def remove_review(self, book_id, rating):
+        """
+        Take a deleted rating out of the stats of a book, in the transaction of
+        the delete. Stats that never counted it, like those of reviews written
+        around the serializer, are left for reconcile_rating_stats.
+        """
+        self.filter(book_id=book_id, review_count__gt=0, **{f'rating_{rating}__gt': 0}).update(
+            review_count=F('review_count') - 1,
+            rating_sum=F('rating_sum') - rating,
+            average_rating=Case(
+                When(review_count__gt=1, then=Cast(F('rating_sum') - rating, FloatField()) / (F('review_count') - 1)),
+                default=None,
+            ),
+            updated_at=timezone.now(),
+            **{f'rating_{rating}': F(f'rating_{rating}') - 1},
+        )
+
+    def compute_from_reviews(self, book_ids):
+        """
+        Aggregate the true stats of the given books straight from the review table.
+        """
+        return {
+            row.pop('book'): row
+            for row in Review.objects.filter(book_id__in=book_ids).values('book').annotate(
+                review_count=Count('id'),
+                rating_sum=Sum('rating'),
+                **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in range(1, 6)},
+            ).order_by()
+        }
+
+
+# Denormalized rating stats of a book, maintained on every review write
+class BookRating(models.Model):
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, related_name='rating_stats')
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    average_rating = models.FloatField(null=True, blank=True, db_index=True)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookRatingManager()
+
+    STAT_FIELDS = (
+        'review_count', 'rating_sum', 'average_rating',
+        'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+    )
+
+    @property
+    def histogram(self):
+        return {rating: getattr(self, f'rating_{rating}') for rating in range(1, 6)}
+
+    def __str__(self):
+        return f"Rating stats of {self.book_id}: {self.average_rating} ({self.review_count})"
@@ -0,0 +1,33 @@
+"""
+Plain dict rendering of reviews, matching the output of ReviewSerializer.
+"""
+
+REVIEW_VALUES = (
+    'id',
+    'review_text',
+    'rating',
+    'created_at',
+    'user_id',
+    'user__username',
+    'user__email',
+)
+
+# Flat columns of the streaming export
+REVIEW_EXPORT_COLUMNS = ('id', 'book_id', 'rating', 'review_text', 'created_at', 'user_id', 'user__username')
+
+
+def review_values(queryset):
+    return queryset.values(*REVIEW_VALUES)
+
+
+def render_review(row):
+    return {
+        'id': row['id'],
+        'review_text': row['review_text'],
+        'rating': row['rating'],
+        'user': {
+            'id': row['user_id'],
+            'username': row['user__username'],
+            'email': row['user__email'],
+        },
+    }
@@ -1,12 +1,14 @@
+from django.db import transaction
+
 from rest_framework import serializers
 
 from apps.book.models import Book
-from apps.review.models import Review
-from apps.user.serializer import UserSerializer
+from apps.review.models import Review, BookRating
+from apps.user.serializer import UserSummarySerializer
 
 
 class ReviewSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = UserSummarySerializer(read_only=True)
     book = serializers.PrimaryKeyRelatedField(queryset=Book.objects.all(), write_only=True)
 
     class Meta:
@@ -20,5 +22,7 @@ class ReviewSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
-        review = Review.objects.create(**validated_data)
-        return review
\ No newline at end of file
+        with transaction.atomic():
+            review = Review.objects.create(**validated_data)
+            BookRating.objects.record_review(review.book_id, review.rating)
+        return review
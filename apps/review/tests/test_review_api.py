@@ -1,6 +1,11 @@
+from io import StringIO
+
+from django.core.management import call_command
+
 from rest_framework import status
 
 from apps.book.tests.factories import BookFactory
+from apps.review.models import BookRating, Review
 from apps.review.tests.factories import ReviewFactory
 from config.test import TestApi
 
@@ -29,3 +34,55 @@ class TestReviewViews(TestApi):
         }
         response = self.client.post(url, data)        
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_review_updates_rating_stats(self):
+        """
+        Test case for the denormalized rating stats.
+        Verifies that:
+        1. Creating reviews updates the count, average and histogram of the book.
+        2. The book detail serves the stats without aggregating the reviews.
+        3. Deleted reviews are taken out of the stats, the last one clears the average.
+        """
+        book = BookFactory()
+        user = self.create_user()
+        self.client.force_authenticate(user=user)
+        for rating in (5, 4, 4):
+            response = self.client.post('/review/', {'book': book.id, 'rating': rating, 'review_text': 'ok'})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        stats = BookRating.objects.get(book=book)
+        self.assertEqual(stats.review_count, 3)
+        self.assertEqual(stats.rating_sum, 13)
+        self.assertAlmostEqual(stats.average_rating, 13 / 3)
+        self.assertEqual(stats.histogram, {1: 0, 2: 0, 3: 0, 4: 2, 5: 1})
+
+        response = self.client.get(f'/book/{book.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertAlmostEqual(response.data['average_rating'], 13 / 3)
+        self.assertEqual(response.data['review_count'], 3)
+        self.assertEqual(response.data['rating_histogram'][4], 2)
+
+        Review.objects.filter(book=book, rating=4).first().delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.review_count, stats.rating_sum, stats.average_rating), (2, 9, 4.5))
+        self.assertEqual(stats.histogram, {1: 0, 2: 0, 3: 0, 4: 1, 5: 1})
+        Review.objects.filter(book=book).delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.review_count, stats.rating_sum, stats.average_rating), (0, 0, None))
+
+    def test_reconcile_rating_stats(self):
+        """
+        Test case for the reconcile_rating_stats command.
+        Verifies that reviews written around the serializer are picked up.
+        """
+        book = BookFactory()
+        ReviewFactory(book=book, rating=2)
+        ReviewFactory(book=book, rating=4)
+        self.assertFalse(BookRating.objects.filter(book=book).exists())
+
+        call_command('reconcile_rating_stats', stdout=StringIO())
+
+        stats = BookRating.objects.get(book=book)
+        self.assertEqual(stats.review_count, 2)
+        self.assertEqual(stats.average_rating, 3.0)
+        self.assertEqual(stats.histogram, {1: 0, 2: 1, 3: 0, 4: 1, 5: 0})
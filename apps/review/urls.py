@@ -1,8 +1,12 @@
+from django.urls import path
+
 from rest_framework.routers import DefaultRouter
 
 from apps.review.views import ReviewViewSet
+from apps.review.async_views import AsyncReviewListView
 
 router=DefaultRouter()
 router.register('', ReviewViewSet, basename='review')
-urlpatterns = router.urls
-
+urlpatterns = [
+    path('async/', AsyncReviewListView.as_view(), name='review-async-list'),
+] + router.urls
@@ -1,16 +1,46 @@
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets,mixins
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
 
+from config.conditional import ConditionalGetMixin
+from config.exports import export_response
+from config.throttling import RateLimitHeadersMixin, UserRateThrottle
+from apps.book.cache import get_validator_versions
 from apps.review.serializer import ReviewSerializer
 from apps.review.models import Review
 from apps.review.filters import ReviewFilter
+from apps.review.rendering import REVIEW_EXPORT_COLUMNS, review_values, render_review
 
-class ReviewViewSet(mixins.CreateModelMixin,mixins.ListModelMixin, viewsets.GenericViewSet):
-    queryset = Review.objects.all()
+class ReviewViewSet(RateLimitHeadersMixin, ConditionalGetMixin, mixins.CreateModelMixin,mixins.ListModelMixin, viewsets.GenericViewSet):
+    queryset = Review.objects.select_related('user')
     serializer_class = ReviewSerializer
     permission_classes=[IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
     filterset_class = ReviewFilter
+    throttle_scope = 'review'
 
+    def get_throttles(self):
+        # Only writing reviews is throttled
+        if self.action == 'create':
+            return [UserRateThrottle()]
+        return super().get_throttles()
 
+    def list(self, request, *args, **kwargs):
+        # Bumped by every review write and username or email change, validated without touching the database
+        versions = get_validator_versions(('reviews', 'users'))
+        etag = self.get_etag(request, *versions.values()) if versions else None
+        not_modified = self.not_modified_response(request, etag)
+        if not_modified:
+            return not_modified
+
+        # Rendered straight from values() rows instead of a serializer per review
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(review_values(queryset))
+        return self.set_validators(self.get_paginated_response([render_review(row) for row in page]), etag)
+
+    # Streams every matching review as NDJSON or CSV without loading them in memory
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        queryset = self.filter_queryset(Review.objects.all()).order_by('id')
+        return export_response(request, queryset, REVIEW_EXPORT_COLUMNS, 'reviews')
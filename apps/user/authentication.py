@@ -0,0 +1,62 @@
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from apps.book.cache import get_or_fill, invalidate_tags
+
+TOKEN_CACHE_TIMEOUT = 60 * 15
+
+
+def _token_cache_key(key):
+    # Never use the raw token as a redis key
+    return 'auth_token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication backed by the tagged cache, so an authenticated
+    request normally costs no database query. Entries are dropped when the
+    token is deleted or its user is saved, which covers logout, password
+    changes and deactivation.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = _token_cache_key(key)
+        # Tagged with its own key, an invalidation also outdates a fill running alongside it
+        entry = get_or_fill(
+            cache_key,
+            lambda: self.fill_credentials(key),
+            timeout=TOKEN_CACHE_TIMEOUT,
+            stale_timeout=0,
+            tags=(cache_key,),
+        )
+        # Fresh instances per request, the cached values are shared by every request of the process
+        user = get_user_model().from_db(DEFAULT_DB_ALIAS, list(entry['user']), list(entry['user'].values()))
+        token = Token.from_db(DEFAULT_DB_ALIAS, list(entry['token']), list(entry['token'].values()))
+        token.user = user
+        return (user, token)
+
+    def fill_credentials(self, key):
+        # Unknown keys and inactive users raise AuthenticationFailed and are never cached
+        user, token = super().authenticate_credentials(key)
+        # The password hash stays out of the cache, the user loads it when it is read
+        return {
+            'user': {
+                field.attname: getattr(user, field.attname)
+                for field in user._meta.concrete_fields if field.attname != 'password'
+            },
+            'token': {field.attname: getattr(token, field.attname) for field in token._meta.concrete_fields},
+        }
+
+
+def invalidate_token(key):
+    invalidate_tags(_token_cache_key(key))
+
+
+def invalidate_user_tokens(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key)
@@ -0,0 +1,159 @@
+import json
+import logging
+import uuid
+from smtplib import SMTPDataError, SMTPRecipientsRefused, SMTPSenderRefused
+
+from django.core.mail import get_connection
+from django.contrib.auth import get_user_model
+from django_redis import get_redis_connection
+
+from apps.user.utils import ACCOUNT_EMAILS
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# Account emails wait in this redis list until a flush sends them over one SMTP connection
+OUTBOX_KEY = 'mail:outbox'
+# A taken batch waits in its own list, leased in this sorted set until the flush
+# acknowledges it. A flush that dies mid batch leaves it there, the next flush
+# puts it back in the outbox once the lease expires, so emails are sent at least once.
+PROCESSING_KEY = 'mail:outbox:processing'
+BATCH_LEASE = 60 * 10
+# Seconds the first queued email waits for others to join its batch. Emails
+# left behind, because the broker was down when the flush was scheduled or the
+# flush gave up retrying, are sent by the celery beat sweep every
+# MAIL_OUTBOX_SWEEP_INTERVAL seconds, run `celery -A config beat` next to the workers.
+BATCH_WINDOW = 2
+BATCH_SIZE = 100
+# Sending attempts of an email the server keeps rejecting
+MAX_ATTEMPTS = 5
+# Rejections of a single message, the connection stays usable for the rest of the batch
+MESSAGE_ERRORS = (SMTPRecipientsRefused, SMTPSenderRefused, SMTPDataError)
+
+
+def push(entries):
+    if entries:
+        get_redis_connection('default').rpush(OUTBOX_KEY, *[json.dumps(entry) for entry in entries])
+
+
+def queue_account_email(user_id, kind):
+    push([{'user_id': user_id, 'kind': kind, 'attempts': 0}])
+
+
+# Moves up to ARGV[1] entries from the head of the outbox to the batch list and leases it on the redis clock
+TAKE_BATCH_SCRIPT = """
+local entries = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #entries > 0 then
+    redis.call('LTRIM', KEYS[1], #entries, -1)
+    redis.call('RPUSH', KEYS[3], unpack(entries))
+    redis.call('ZADD', KEYS[2], tonumber(redis.call('TIME')[1]) + tonumber(ARGV[2]), KEYS[3])
+end
+return entries
+"""
+
+# Puts an expired batch back in the outbox, unless it was acknowledged or requeued meanwhile
+REQUEUE_BATCH_SCRIPT = """
+if redis.call('ZREM', KEYS[2], KEYS[3]) == 1 then
+    local entries = redis.call('LRANGE', KEYS[3], 0, -1)
+    if #entries > 0 then
+        redis.call('RPUSH', KEYS[1], unpack(entries))
+    end
+    redis.call('DEL', KEYS[3])
+end
+"""
+
+_take_batch_script = None
+_requeue_batch_script = None
+
+
+def _get_take_batch_script():
+    global _take_batch_script
+    if _take_batch_script is None:
+        _take_batch_script = get_redis_connection('default').register_script(TAKE_BATCH_SCRIPT)
+    return _take_batch_script
+
+
+def _get_requeue_batch_script():
+    global _requeue_batch_script
+    if _requeue_batch_script is None:
+        _requeue_batch_script = get_redis_connection('default').register_script(REQUEUE_BATCH_SCRIPT)
+    return _requeue_batch_script
+
+
+def take_batch(size=BATCH_SIZE):
+    """
+    Atomically move up to size entries from the head of the outbox to a leased
+    batch, returns the batch key to acknowledge and the entries.
+    """
+    batch_key = f'{PROCESSING_KEY}:{uuid.uuid4().hex}'
+    entries = _get_take_batch_script()(keys=[OUTBOX_KEY, PROCESSING_KEY, batch_key], args=[size, BATCH_LEASE])
+    return batch_key, [json.loads(entry) for entry in entries]
+
+
+def ack(batch_key):
+    """
+    Forget a batch once every entry was sent, dropped or pushed back to the outbox.
+    """
+    pipeline = get_redis_connection('default').pipeline(transaction=True)
+    pipeline.zrem(PROCESSING_KEY, batch_key)
+    pipeline.delete(batch_key)
+    pipeline.execute()
+
+
+def requeue_expired():
+    """
+    Put the batches of flushes that died before acknowledging them back in the outbox.
+    """
+    connection = get_redis_connection('default')
+    now, _ = connection.time()
+    for batch_key in connection.zrangebyscore(PROCESSING_KEY, '-inf', now):
+        _get_requeue_batch_script()(keys=[OUTBOX_KEY, PROCESSING_KEY, batch_key.decode()])
+
+
+def send_batch(entries):
+    """
+    Build and send the emails of entries over a single SMTP connection.
+
+    Emails rejected by the server are queued again until MAX_ATTEMPTS. When
+    the connection itself fails the unsent entries go back to the outbox and
+    the error is raised, so the caller can retry later. Returns the counts of
+    sent, requeued and dropped emails.
+    """
+    users = User.objects.in_bulk({entry['user_id'] for entry in entries})
+    result = {'sent': 0, 'requeued': 0, 'dropped': 0}
+    retry = []
+
+    pending = list(entries)
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        while pending:
+            entry = pending[0]
+            user = users.get(entry['user_id'])
+            if user is None:
+                logger.error("Failed to send the %s email, user %s not found", entry['kind'], entry['user_id'])
+                result['dropped'] += 1
+            else:
+                try:
+                    connection.send_messages([ACCOUNT_EMAILS[entry['kind']](user)])
+                    result['sent'] += 1
+                except MESSAGE_ERRORS:
+                    logger.exception("The mail server rejected the %s email of user %s", entry['kind'], user.pk)
+                    entry['attempts'] += 1
+                    if entry['attempts'] < MAX_ATTEMPTS:
+                        retry.append(entry)
+                    else:
+                        result['dropped'] += 1
+            pending.pop(0)
+    except Exception:
+        # Connection lost, nothing after the failing email was sent
+        push(pending)
+        raise
+    finally:
+        push(retry)
+        result['requeued'] = len(retry) + len(pending)
+        connection.close()
+        logger.info(
+            "Mail batch: %(sent)s sent, %(requeued)s requeued, %(dropped)s dropped", result
+        )
+    return result
@@ -1,9 +1,18 @@
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from rest_framework.authtoken.models import Token
 
+from apps.book.cache import invalidate_tags
+from apps.user.authentication import invalidate_token, invalidate_user_tokens
+
+# Time of the last username or email change, part of the Last-Modified of the book detail
+USERS_UPDATED_KEY = 'users:updated_at'
+
 # Make the email field unique and required for the auth User model
 User._meta.get_field('email')._unique = True
 User._meta.get_field('email').blank = False
@@ -13,4 +22,31 @@ User._meta.get_field('email').null = False
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
-        Token.objects.create(user=instance)
\ No newline at end of file
+        Token.objects.create(user=instance)
+
+
+# Drop cached tokens once a user change is committed (password change, reset, deactivation)
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_tokens(sender, instance=None, created=False, **kwargs):
+    if not created:
+        transaction.on_commit(lambda: invalidate_user_tokens(instance.pk))
+
+
+# Books and reviews embed the username and email of their user, drop the cached
+# entries and validators built from them. Logins and password changes name neither.
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_embedded_user(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not {'username', 'email'} & set(update_fields)):
+        return
+
+    def invalidate():
+        cache.set(USERS_UPDATED_KEY, timezone.now(), timeout=None)
+        invalidate_tags('users')
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance=None, **kwargs):
+    key = instance.key  # The primary key is cleared once the delete completes
+    transaction.on_commit(lambda: invalidate_token(key))
@@ -1,4 +1,3 @@
-from django.db import transaction
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.utils.http import urlsafe_base64_decode
@@ -10,8 +9,7 @@ from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework import serializers
 
-from apps.user.tasks import send_verification_email_task
-from apps.user.utils import send_reset_email
+from apps.user.tasks import schedule_account_email
 User = get_user_model()
 
 class UserSerializer(serializers.ModelSerializer):
@@ -41,11 +39,18 @@ class UserSerializer(serializers.ModelSerializer):
         user.set_password(validated_data['password'])       
         user.is_active = False  # Inactive until email is verified
         user.save()
-        print(f"Scheduling send_verification_email_task for user {user.id}")
-        transaction.on_commit(lambda:send_verification_email_task.delay(user.id)) 
+        schedule_account_email(user, 'verification')
         return user
        
 
+# Read only user embedded in book, review and favorite responses, without the password fields
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'email')
+        read_only_fields = fields
+
+
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField(max_length=255, min_length=3)
     password = serializers.CharField(max_length=68, min_length=6, write_only=True)
@@ -99,10 +104,8 @@ class ForgotPasswordSerializer(serializers.Serializer):
         return value
     
     def send_reset_pass_email(self):
-        send_reset_email(self.user)
-
-    # def send_reset_pass_email(self):
-    #     send_reset_email(self.user)
+        # Sent by a celery worker, the request does not wait on the mail server
+        schedule_account_email(self.user, 'reset_password')
 
     
 # Serializer for resetting the user's password
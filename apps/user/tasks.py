@@ -1,35 +1,76 @@
 import logging
+from smtplib import SMTPException
 
-from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
 
 from celery import shared_task
-from time import sleep
-from apps.user.utils import send_verification_email, send_reset_email
+from kombu.exceptions import OperationalError
+from apps.user import mail
 
-User = get_user_model()
 logger = logging.getLogger(__name__)
 
-@shared_task(name='send_verification_email')
-def send_verification_email_task(user_id):
+# A second request for the same email within this many seconds does not send another one
+ACCOUNT_EMAIL_DEDUPE_WINDOW = 60 * 5
+FLUSH_SCHEDULED_KEY = 'mail:flush_scheduled'
+
+
+@shared_task(
+    name='flush_mail_outbox',
+    autoretry_for=(SMTPException, OSError),
+    retry_backoff=30,
+    retry_backoff_max=60 * 10,
+    retry_jitter=True,
+    max_retries=5,
+)
+def flush_mail_outbox_task():
     """
-    Task to send verification email
+    Task to send every queued account email in batches sharing one SMTP
+    connection, retried with exponential backoff while the mail server is unreachable
     """
-    user = User.objects.filter(id=user_id).first()  
-    if user:
-        send_verification_email(user)
-    else:
-        logger.error("User not found")
+    totals = {'sent': 0, 'requeued': 0, 'dropped': 0}
+    mail.requeue_expired()
+    batch_key, entries = mail.take_batch()
+    while entries:
+        try:
+            counts = mail.send_batch(entries)
+        finally:
+            # Sent or back in the outbox, even when the connection failed
+            mail.ack(batch_key)
+        for name, count in counts.items():
+            totals[name] += count
+        if totals['requeued']:
+            # Rejected emails are back in the outbox, they wait for the next flush
+            schedule_flush()
+            break
+        batch_key, entries = mail.take_batch()
+    return totals
+
 
+def schedule_flush():
+    # Only the first email of a window schedules the flush, the others join its batch
+    if not cache.add(FLUSH_SCHEDULED_KEY, 1, timeout=mail.BATCH_WINDOW):
+        return
+    try:
+        flush_mail_outbox_task.apply_async(countdown=mail.BATCH_WINDOW)
+    except OperationalError:
+        # Broker down, the emails stay in the outbox for the next flush
+        cache.delete(FLUSH_SCHEDULED_KEY)
+        logger.exception("Failed to schedule the mail outbox flush")
 
-# @shared_task(name='send_reset_email')
-# def send_reset_email_task(user_id):
-#     """
-#     Task to send password reset email
-#     """
-#     user = User.objects.filter(id=user_id)
-#     if user:
-#         send_reset_email(user)
-#     else:
-#         logger.error("Failed to send the email, user not found")
 
+def schedule_account_email(user, kind):
+    """
+    Queue an account email once the transaction commits, unless the same email
+    was already queued for the user within the dedupe window.
+    """
+    dedupe_key = f'account_email:{kind}:{user.pk}'
+
+    def enqueue():
+        # Claimed on commit, a rolled back request leaves the retry free to send it
+        if not cache.add(dedupe_key, 1, timeout=ACCOUNT_EMAIL_DEDUPE_WINDOW):
+            return
+        mail.queue_account_email(user.pk, kind)
+        schedule_flush()
 
+    transaction.on_commit(enqueue)
@@ -0,0 +1,192 @@
+import socketserver
+import threading
+from smtplib import SMTPServerDisconnected
+from unittest.mock import patch
+
+from celery import current_app
+from django.conf import settings
+from django.test import override_settings
+from django_redis import get_redis_connection
+from kombu.exceptions import OperationalError
+
+from config.test import TestApi
+from apps.user import mail
+from apps.user.tasks import flush_mail_outbox_task, schedule_account_email
+from apps.user.tests.factories import UserFactory
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """
+    Minimal local SMTP server recording the connections and messages it receives.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, rejected=()):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.rejected = set(rejected)
+        self.connections = 0
+        self.messages = []
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ready')
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address in self.server.rejected:
+                    self.reply('550 No such user')
+                    continue
+                recipients.append(address)
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                body = []
+                while (line := self.rfile.readline()) not in (b'.\r\n', b''):
+                    body.append(line)
+                self.server.messages.append((recipients, b''.join(body)))
+                recipients = []
+            elif verb in ('MAIL', 'RSET'):
+                recipients = []
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            self.reply('250 OK')
+
+
+def smtp_settings(server):
+    return override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1',
+        EMAIL_PORT=server.server_address[1],
+        EMAIL_USE_TLS=False,
+        EMAIL_HOST_PASSWORD='',
+    )
+
+
+class TestMailOutbox(TestApi):
+
+    def test_flush_sends_batch_over_one_connection(self):
+        """
+        Test case for flushing the mail outbox.
+        Verifies that:
+        1. Every queued email is sent over a single SMTP connection.
+        2. The flush reports the number of sent emails and empties the outbox.
+        """
+        users = UserFactory.create_batch(3)
+        for user in users:
+            mail.queue_account_email(user.id, 'reset_password')
+
+        with SMTPStandIn() as server, smtp_settings(server):
+            result = flush_mail_outbox_task.apply().get()
+
+        self.assertEqual(result, {'sent': 3, 'requeued': 0, 'dropped': 0})
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(
+            sorted(recipients[0] for recipients, _ in server.messages),
+            sorted(user.email for user in users)
+        )
+        self.assertEqual(mail.take_batch()[1], [])
+
+    @patch('apps.user.tasks.schedule_flush')
+    def test_flush_requeues_failures(self, mock_schedule_flush):
+        """
+        Test case for emails that could not be sent.
+        Verifies that:
+        1. An email rejected by the server is requeued without stopping the batch.
+        2. A lost connection puts the unsent emails back in the outbox.
+        """
+        user, rejected_user = UserFactory.create_batch(2)
+        mail.queue_account_email(rejected_user.id, 'verification')
+        mail.queue_account_email(user.id, 'verification')
+
+        with SMTPStandIn(rejected=[rejected_user.email]) as server, smtp_settings(server):
+            result = flush_mail_outbox_task.apply().get()
+        self.assertEqual(result, {'sent': 1, 'requeued': 1, 'dropped': 0})
+        mock_schedule_flush.assert_called_once()
+        self.assertEqual(
+            mail.take_batch()[1],
+            [{'user_id': rejected_user.id, 'kind': 'verification', 'attempts': 1}]
+        )
+
+        entries = [{'user_id': user.id, 'kind': 'verification', 'attempts': 0}]
+        with SMTPStandIn() as server, smtp_settings(server):
+            with patch.object(SMTPHandler, 'handle', lambda handler: None):
+                with self.assertRaises((SMTPServerDisconnected, OSError)):
+                    mail.send_batch(entries)
+        self.assertEqual(mail.take_batch()[1], entries)
+
+    def test_flush_requeues_unacknowledged_batches(self):
+        """
+        Test case for a batch taken by a flush that died before sending it.
+        Verifies that:
+        1. The batch is not sent again while its lease runs.
+        2. The next flush after the lease expired sends it.
+        """
+        connection = get_redis_connection('default')
+        user = UserFactory()
+        mail.queue_account_email(user.id, 'verification')
+        batch_key, _ = mail.take_batch()
+
+        with SMTPStandIn() as server, smtp_settings(server):
+            self.assertEqual(flush_mail_outbox_task.apply().get(), {'sent': 0, 'requeued': 0, 'dropped': 0})
+            connection.zadd(mail.PROCESSING_KEY, {batch_key: 0})
+            self.assertEqual(flush_mail_outbox_task.apply().get(), {'sent': 1, 'requeued': 0, 'dropped': 0})
+        self.assertEqual(server.messages[0][0], [user.email])
+        self.assertEqual(connection.zcard(mail.PROCESSING_KEY), 0)
+        self.assertFalse(connection.exists(batch_key))
+
+    @patch('apps.user.tasks.flush_mail_outbox_task.apply_async')
+    def test_rolled_back_email_is_not_deduplicated(self, mock_apply_async):
+        """
+        Test case for an account email requested in a rolled back transaction.
+        Verifies that:
+        1. Nothing is queued and the dedupe window is not claimed.
+        2. The retry queues the email, a repeat within the window does not.
+        """
+        user = UserFactory()
+        # Callbacks not executed, as when the transaction rolls back
+        with self.captureOnCommitCallbacks(execute=False):
+            schedule_account_email(user, 'reset_password')
+        self.assertEqual(mail.take_batch()[1], [])
+
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_account_email(user, 'reset_password')
+        mock_apply_async.assert_called_once()
+        self.assertEqual(mail.take_batch()[1], [{'user_id': user.id, 'kind': 'reset_password', 'attempts': 0}])
+
+    @patch('apps.user.tasks.flush_mail_outbox_task.apply_async', side_effect=OperationalError)
+    def test_beat_sweeps_stranded_emails(self, mock_apply_async):
+        """
+        Test case for emails whose flush could not be scheduled.
+        Verifies that:
+        1. The email stays in the outbox while the broker is down.
+        2. The task scheduled by celery beat sends it.
+        """
+        user = UserFactory()
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_account_email(user, 'reset_password')
+        mock_apply_async.assert_called_once()
+
+        sweep = current_app.tasks[settings.CELERYBEAT_SCHEDULE['sweep-mail-outbox']['task']]
+        with SMTPStandIn() as server, smtp_settings(server):
+            result = sweep.apply().get()
+        self.assertEqual(result, {'sent': 1, 'requeued': 0, 'dropped': 0})
+        self.assertEqual(server.messages[0][0], [user.email])
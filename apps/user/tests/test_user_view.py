@@ -1,19 +1,25 @@
 from unittest.mock import patch
 
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
 
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 
 from config.test import TestApi
+from apps.user.authentication import CachedTokenAuthentication, _token_cache_key, invalidate_user_tokens
+from apps.user.tasks import flush_mail_outbox_task
 from apps.user.tests.factories import UserFactory
 
 
 class TestUser(TestApi):
 
-    @patch('apps.user.tasks.send_verification_email_task')
-    def test_register_user(self, mock_send_verification_email_task):
+    @patch('apps.user.tasks.flush_mail_outbox_task')
+    def test_register_user(self, mock_flush_mail_outbox_task):
         """
         Test case for user registration.
         Verifies that:
@@ -47,7 +53,7 @@ class TestUser(TestApi):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code,status.HTTP_400_BAD_REQUEST)
 
-        self.assertTrue(mock_send_verification_email_task.is_called())
+        self.assertTrue(mock_flush_mail_outbox_task.is_called())
 
 
     def test_verify_email(self):
@@ -168,8 +174,22 @@ class TestUser(TestApi):
             'email': 'testuser@example.com'
         }
         
-        response = self.client.post(url, data)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with patch('apps.user.tasks.flush_mail_outbox_task.apply_async') as mock_apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(url, data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            mock_apply_async.assert_called_once()
+
+            # A repeated request within the dedupe window does not queue another email
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(url, data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # The flush builds and sends the reset link
+        self.assertEqual(flush_mail_outbox_task.apply().get(), {'sent': 1, 'requeued': 0, 'dropped': 0})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [user.email])
+        self.assertIn('/user/reset_password/', mail.outbox[0].body)
 
     def test_reset_passwords(self):
         """
@@ -213,6 +233,109 @@ class TestUser(TestApi):
         response = self.client.post('/user/login/', login_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_cached_token_authentication(self):
+        """
+        Test case for the cached token authentication.
+        Verifies that:
+        1. Only the first request with a token queries the database to authenticate.
+        2. A deactivated user or a logged out token is rejected right after the commit.
+        3. The cache holds no password hash and every request gets its own user.
+        4. A user deactivated while its token was being cached is rejected.
+        """
+        user = self.create_user()
+        token = Token.objects.get(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        url = '/user/change_password/'
 
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
-       
\ No newline at end of file
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/user/logout/')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.is_active = False
+            user.save(update_fields=['is_active'])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        other = self.create_user()
+        key = Token.objects.get(user=other).key
+        authentication = CachedTokenAuthentication()
+        first, _ = authentication.authenticate_credentials(key)
+        second, _ = authentication.authenticate_credentials(key)
+        self.assertIsNot(first, second)
+        self.assertNotIn('password', cache.get(_token_cache_key(key))['value']['user'])
+        self.assertTrue(second.check_password('password@123'))
+
+        fill_credentials = CachedTokenAuthentication.fill_credentials
+
+        def fill_then_deactivate(authentication, key):
+            entry = fill_credentials(authentication, key)
+            # Committed after the fill read the user, before its entry is written
+            User.objects.filter(pk=other.pk).update(is_active=False)
+            invalidate_user_tokens(other.pk)
+            return entry
+
+        invalidate_user_tokens(other.pk)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        with patch.object(CachedTokenAuthentication, 'fill_credentials', fill_then_deactivate):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+    def test_login_rate_limit(self):
+        """
+        Test case for the login rate limit.
+        Verifies that:
+        1. Responses report the remaining quota in the X-RateLimit headers.
+        2. Login attempts for one username are rejected once its quota is spent.
+        3. Other usernames are not affected.
+        4. A body that is not an object is rejected, not a server error.
+        """
+        user = self.create_user()
+        url = '/user/login/'
+        data = {'username': user.username, 'password': 'wrong'}
+
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response['X-RateLimit-Limit'], '5')
+        self.assertEqual(response['X-RateLimit-Remaining'], '4')
+        for _ in range(4):
+            self.client.post(url, data, format='json')
+
+        data['username'] = user.username.upper()
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+        response = self.client.post(url, {'username': 'someone_else', 'password': 'wrong'}, format='json')
+        self.assertNotEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        response = self.client.post(url, [data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ip_rate_limit_ignores_forwarded_for(self):
+        """
+        Test case for the per address rate limit.
+        Verifies that:
+        1. A client rotating X-Forwarded-For is still limited by its own address.
+        """
+        url = '/user/forgot_password/'
+        for number in range(10):
+            response = self.client.post(
+                url, {'email': f'nobody{number}@example.com'}, format='json',
+                HTTP_X_FORWARDED_FOR=f'10.0.0.{number}',
+            )
+            self.assertNotEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.post(
+            url, {'email': 'nobody10@example.com'}, format='json', HTTP_X_FORWARDED_FOR='10.0.0.10'
+        )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
@@ -5,11 +5,13 @@ from django.shortcuts import get_object_or_404
 from django.contrib.auth.tokens import default_token_generator 
 
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.generics import GenericAPIView
 
+from config.throttling import RateLimitHeadersMixin, IPRateThrottle, IdentifierRateThrottle
 from apps.user.serializer import ( 
     UserSerializer,
     ChangePasswordSerializer,
@@ -19,8 +21,10 @@ from apps.user.serializer import (
     )
 
 
-class RegisterUser(GenericAPIView):
+class RegisterUser(RateLimitHeadersMixin, GenericAPIView):
     serializer_class = UserSerializer
+    throttle_classes = [IPRateThrottle]
+    throttle_scope = 'register'
 
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
@@ -48,8 +52,12 @@ class VerifyEmail(APIView):
         else:
             return Response({'msg': 'Invalid token.'}, status=status.HTTP_400_BAD_REQUEST)
 
-class UserLogin(GenericAPIView):
+class UserLogin(RateLimitHeadersMixin, GenericAPIView):
     serializer_class = LoginSerializer 
+    # authenticate() runs a deliberately slow password hash, cap it per address and per account
+    throttle_classes = [IPRateThrottle, IdentifierRateThrottle]
+    throttle_scope = 'login'
+    throttle_identifier_field = 'username'
 
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
@@ -70,8 +78,11 @@ class ChangePassword(GenericAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ForgotPassword(GenericAPIView):
+class ForgotPassword(RateLimitHeadersMixin, GenericAPIView):
     serializer_class = ForgotPasswordSerializer
+    throttle_classes = [IPRateThrottle, IdentifierRateThrottle]
+    throttle_scope = 'forgot_password'
+    throttle_identifier_field = 'email'
     
     def post(self, request, *args, **kwargs):
         serializer = ForgotPasswordSerializer(data=request.data)
@@ -94,5 +105,7 @@ class Logout(APIView):
    permission_classes=[IsAuthenticated] 
    
    def post(self, request):
+        # Deleting the token also drops it from the token cache
+        Token.objects.filter(user=request.user).delete()
         logout(request)
         return Response({'msg': 'Logged out successfully.'})
\ No newline at end of file
@@ -0,0 +1,87 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views import View
+from django_filters.rest_framework import DjangoFilterBackend
+
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from config.conditional import ConditionalGetMixin
+from config.renderers import ORJSONRenderer
+
+
+def run_in_thread(func, *args):
+    """
+    Await a call that only talks to redis on a pool thread. The ORM queries of
+    a request all run on one thread, a call kept off it overlaps with them
+    instead of queueing behind them.
+    """
+    return sync_to_async(func, thread_sensitive=False)(*args)
+
+
+class AsyncReadView(ConditionalGetMixin, View):
+    """
+    Read only JSON endpoint whose handlers are coroutines, served on the event
+    loop under ASGI. Authentication, permissions, filters, pagination and error
+    bodies are DRF's, the parts that query run through sync_to_async.
+    """
+    http_method_names = ['get', 'head', 'options']
+    permission_classes = ()
+    filterset_class = None
+    renderer = ORJSONRenderer()
+    not_modified_class = HttpResponse
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.request = Request(
+            request,
+            authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+        )
+        # JSON only, the ETags still tell the formats apart
+        self.request.accepted_renderer = self.renderer
+        self.request.accepted_media_type = self.renderer.media_type
+        try:
+            await sync_to_async(self.initial)(self.request)
+            return await super().dispatch(self.request, *args, **kwargs)
+        except Exception as exc:
+            return self.handle_exception(exc)
+
+    def initial(self, request):
+        # Authenticates up front, a token missing from the cache is looked up in the database
+        request.user
+        self.check_permissions(request)
+
+    def check_permissions(self, request):
+        for permission in self.permission_classes:
+            if not permission().has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied()
+
+    def handle_exception(self, exc):
+        # Same status codes and bodies as the DRF views
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            exc.auth_header = self.request.authenticators[0].authenticate_header(self.request)
+        response = exception_handler(exc, {'view': self, 'request': self.request})
+        if response is None:
+            raise exc
+        rendered = self.json_response(response.data, status=response.status_code)
+        for header, value in response.items():
+            rendered[header] = value
+        return rendered
+
+    def json_response(self, data, status=200):
+        return HttpResponse(self.renderer.render(data), status=status, content_type=self.renderer.media_type)
+
+    def paginate(self, queryset, paginator, values):
+        """
+        Filter queryset by the query string and return the values() rows of one
+        page. Run it with sync_to_async, validating a filter can query as well.
+        """
+        if self.filterset_class is not None:
+            queryset = DjangoFilterBackend().filter_queryset(self.request, queryset, self)
+        return paginator.paginate_queryset(values(queryset), self.request, view=self)
+
+    def paginated_response(self, paginator, results):
+        return self.json_response(paginator.get_paginated_response(results).data)
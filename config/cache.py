@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from config import metrics
+
+
+class LocalCache:
+    """
+    Small thread safe LRU kept in each worker process, so hot keys are
+    served without a redis round trip for a few seconds.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_tagged(self, tags):
+        with self._lock:
+            for key, (expires, envelope) in list(self._entries.items()):
+                if not tags.isdisjoint(envelope.get('tags', ())):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CacheStats:
+    """
+    Per process counters of cache hits, misses and the time spent filling.
+    """
+
+    def __init__(self):
+        self._counters = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+        # Also counted for the current request
+        metrics.record(f'cache_{name}', value)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
@@ -0,0 +1,46 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    """
+    ETag and Last-Modified support for viewsets. The validators are computed
+    from cheap version values before the view queries and serializes
+    anything, so an unchanged resource costs a 304 with an empty body. A
+    view that cannot validate a response passes None as its etag.
+    """
+    # Request headers the representation depends on
+    vary_headers = ('Accept',)
+    # Class of the empty 304 and 412 responses
+    not_modified_class = Response
+
+    def get_etag(self, request, *versions):
+        # The query string picks the page and the negotiated format the encoding
+        key = repr((versions, request.get_full_path(), request.accepted_media_type))
+        return quote_etag(hashlib.blake2b(key.encode(), digest_size=16).hexdigest())
+
+    def not_modified_response(self, request, etag, last_modified=None):
+        """
+        Return a 304 response when the client copy is current (or a 412 when
+        an If-Match precondition fails), None when the view should respond.
+        """
+        if etag is None and last_modified is None:
+            return None
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        conditional = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if conditional is None:
+            return None
+        response = self.not_modified_class(status=conditional.status_code)
+        return self.set_validators(response, etag, last_modified)
+
+    def set_validators(self, response, etag, last_modified=None):
+        if etag:
+            response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        patch_vary_headers(response, self.vary_headers)
+        return response
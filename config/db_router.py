@@ -0,0 +1,118 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from rest_framework.permissions import SAFE_METHODS
+
+# Whether the queries of the current request may read from a replica, set by
+# ReplicaRoutingMiddleware. Anything outside a request, like management
+# commands and celery tasks, uses the primary.
+_reads_from_replica = ContextVar('reads_from_replica', default=False)
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of read only requests to a random replica and every other
+    query to the primary. Reads inside a transaction stay on the primary, so
+    they see the writes made in it.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            not _reads_from_replica.get()
+            or not settings.REPLICA_DATABASES
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.REPLICA_DATABASES)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        return db == DEFAULT_DB_ALIAS
+
+
+def reads_from_replica():
+    """
+    Whether the reads of the current request may go to a replica.
+    """
+    return _reads_from_replica.get() and bool(settings.REPLICA_DATABASES)
+
+
+@contextmanager
+def use_primary():
+    """
+    Read from the primary inside the block, for reads that must see a write
+    made moments ago, possibly by another request.
+    """
+    token = _reads_from_replica.set(False)
+    try:
+        yield
+    finally:
+        _reads_from_replica.reset(token)
+
+
+def _sticky_key(request):
+    # Per client, the credentials of the request or its address when anonymous
+    client = request.META.get('HTTP_AUTHORIZATION') or request.META.get('REMOTE_ADDR', '')
+    return 'db:sticky:' + hashlib.sha256(client.encode()).hexdigest()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets GET, HEAD and OPTIONS requests read from the replicas. A client that
+    wrote something reads from the primary for the next REPLICA_STICKY_SECONDS,
+    so it sees its own review, favorite or book update while the replicas
+    catch up.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _reads_from_replica.set(self.may_read_from_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _reads_from_replica.reset(token)
+        self.record_write(request, response)
+        return response
+
+    async def __acall__(self, request):
+        may_read_from_replica = await sync_to_async(self.may_read_from_replica, thread_sensitive=False)(request)
+        token = _reads_from_replica.set(may_read_from_replica)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _reads_from_replica.reset(token)
+        await sync_to_async(self.record_write, thread_sensitive=False)(request, response)
+        return response
+
+    def may_read_from_replica(self, request):
+        return (
+            bool(settings.REPLICA_DATABASES)
+            and request.method in SAFE_METHODS
+            and not cache.get(_sticky_key(request))
+        )
+
+    def record_write(self, request, response):
+        if settings.REPLICA_DATABASES and request.method not in SAFE_METHODS and response.status_code < 400:
+            cache.set(_sticky_key(request), 1, settings.REPLICA_STICKY_SECONDS)
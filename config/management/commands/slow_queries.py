@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from config.slow_queries import clear_slow_queries, get_slow_queries
+
+
+class Command(BaseCommand):
+    help = 'Print the latest slow queries with their plans, newest first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--clear', action='store_true', help='Empty the log after printing it.')
+
+    def handle(self, *args, **options):
+        entries = get_slow_queries(max(options['limit'], 1))
+        for entry in entries:
+            self.stdout.write(self.style.WARNING(
+                f"{entry['at']}  {entry['duration_ms']} ms  {entry['database']}  "
+                f"{entry['view'] or '-'}  {entry['path'] or '-'}"
+            ))
+            self.stdout.write(entry['sql'])
+            self.stdout.write(f"params: {entry['params']}")
+            self.stdout.write(entry['plan'] + '\n')
+        if options['clear']:
+            clear_slow_queries()
+        self.stdout.write(self.style.SUCCESS(f'{len(entries)} slow queries.'))
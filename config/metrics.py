@@ -0,0 +1,230 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from config import slow_queries
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'metrics:requests'
+# Each process sums its observations and adds them to redis at most this often
+FLUSH_INTERVAL = 5
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Time spent handling the request.', DURATION_BUCKETS),
+    'http_request_sql_queries': ('SQL queries run by the request.', QUERY_BUCKETS),
+    'http_request_sql_duration_seconds': ('Time spent running SQL queries.', DURATION_BUCKETS),
+    'http_request_serialize_duration_seconds': ('Time spent rendering the response body.', DURATION_BUCKETS),
+}
+COUNTERS = {
+    'http_request_cache_hits_total': 'Cache hits, fresh or stale.',
+    'http_request_cache_misses_total': 'Cache misses.',
+}
+
+# Measurements of the current request and the request itself, None outside a request
+_current = ContextVar('request_metrics', default=None)
+_current_request = ContextVar('current_request', default=None)
+
+
+def record(name, value=1):
+    """
+    Add value to a measurement of the current request, dropped outside a request.
+    """
+    values = _current.get()
+    if values is not None:
+        values[name] += value
+
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(f'{name}_seconds', time.perf_counter() - start)
+
+
+def _time_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        result = execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        values = _current.get()
+        if values is not None:
+            values['sql_queries'] += 1
+            values['sql_seconds'] += duration
+    if duration >= settings.SLOW_QUERY_THRESHOLD and not many:
+        slow_queries.maybe_record(context['connection'], sql, params, duration, _current_request.get())
+    return result
+
+
+def install_query_timer(connection, **kwargs):
+    # First in the list, execute_wrapper() blocks pop the last one on exit
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _time_query)
+
+
+connection_created.connect(install_query_timer)
+
+
+def _format_value(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def _format_labels(**labels):
+    escaped = {
+        name: str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        for name, value in labels.items()
+    }
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped.items()) + '}'
+
+
+class MetricsRegistry:
+    """
+    Per route histograms and counters in the Prometheus text format. The
+    sums of every process are kept in a redis hash, so a scrape reports all
+    workers whichever one serves it.
+    """
+
+    def __init__(self):
+        self._pending = defaultdict(float)
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def observe(self, name, route, method, value):
+        with self._lock:
+            # Buckets are cumulative, an observation counts in every bucket it fits
+            for bound in HISTOGRAMS[name][1]:
+                if value <= bound:
+                    self._pending[(f'{name}_bucket', route, method, _format_value(bound))] += 1
+            self._pending[(f'{name}_bucket', route, method, '+Inf')] += 1
+            self._pending[(f'{name}_sum', route, method, '')] += value
+            self._pending[(f'{name}_count', route, method, '')] += 1
+
+    def incr(self, name, route, method, value):
+        if value:
+            with self._lock:
+                self._pending[(name, route, method, '')] += value
+
+    def flush(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self._flushed_at < FLUSH_INTERVAL:
+                return
+            pending, self._pending = self._pending, defaultdict(float)
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            pipeline = get_redis_connection('default').pipeline(transaction=False)
+            for field, value in pending.items():
+                pipeline.hincrbyfloat(METRICS_KEY, '\t'.join(field), value)
+            pipeline.execute()
+        except RedisError:
+            # Losing a few seconds of metrics beats failing the request
+            logger.exception('Could not flush %d request metrics', len(pending))
+
+    def render(self):
+        self.flush(force=True)
+        series = defaultdict(list)
+        for field, value in get_redis_connection('default').hgetall(METRICS_KEY).items():
+            name, route, method, le = field.decode().split('\t')
+            series[name].append((route, method, le, float(value)))
+
+        lines = []
+        for name, (help_text, _) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for route, method, le, value in sorted(series[f'{name}_bucket'], key=lambda row: (*row[:2], float(row[2]))):
+                lines.append(f'{name}_bucket{_format_labels(route=route, method=method, le=le)} {_format_value(value)}')
+            for suffix in ('_sum', '_count'):
+                for route, method, _, value in sorted(series[name + suffix]):
+                    lines.append(f'{name}{suffix}{_format_labels(route=route, method=method)} {_format_value(value)}')
+        for name, help_text in COUNTERS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for route, method, _, value in sorted(series[name]):
+                lines.append(f'{name}{_format_labels(route=route, method=method)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetricsMiddleware:
+    """
+    Measures the SQL queries and their time, the cache hits and misses and the
+    time spent rendering the body of every request. They are sent back in a
+    Server-Timing header and added to the per route histograms of /metrics.
+    Slow queries are logged with the request that ran them. Bodies streamed
+    after the response is returned are not measured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Connections opened before the middleware was loaded missed connection_created
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        values = defaultdict(float)
+        values_token, request_token = _current.set(values), _current_request.set(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(values_token)
+            _current_request.reset(request_token)
+        self.report(request, response, values, time.perf_counter() - start)
+        registry.flush()
+        return response
+
+    async def __acall__(self, request):
+        values = defaultdict(float)
+        values_token, request_token = _current.set(values), _current_request.set(request)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(values_token)
+            _current_request.reset(request_token)
+        self.report(request, response, values, time.perf_counter() - start)
+        await sync_to_async(registry.flush, thread_sensitive=False)()
+        return response
+
+    def report(self, request, response, values, duration):
+        hits = values['cache_hits'] + values['cache_stale_hits']
+        misses = values['cache_misses']
+        response['Server-Timing'] = ', '.join((
+            f'sql;dur={values["sql_seconds"] * 1000:.1f};desc="{values["sql_queries"]:.0f} queries"',
+            f'cache;desc="{hits:.0f} hits, {misses:.0f} misses"',
+            f'serialize;dur={values["serialize_seconds"] * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ))
+
+        # Named routes keep the label count bounded, unknown paths share one
+        match = request.resolver_match
+        route, method = (match.view_name if match else 'unmatched'), request.method
+        registry.observe('http_request_duration_seconds', route, method, duration)
+        registry.observe('http_request_sql_queries', route, method, values['sql_queries'])
+        registry.observe('http_request_sql_duration_seconds', route, method, values['sql_seconds'])
+        registry.observe('http_request_serialize_duration_seconds', route, method, values['serialize_seconds'])
+        registry.incr('http_request_cache_hits_total', route, method, hits)
+        registry.incr('http_request_cache_misses_total', route, method, misses)
+
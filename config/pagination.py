@@ -0,0 +1,73 @@
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the (created_at, id) index. Unlike OFFSET the cost of
+    a page does not grow with its position, and no COUNT(*) is run.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
+
+
+class EmbeddedReviewPagination(CreatedAtCursorPagination):
+    # Pages the reviews embedded in a book detail without clashing with its own cursor
+    page_size = 20
+    page_size_query_param = 'reviews_page_size'
+    cursor_query_param = 'reviews_cursor'
+
+
+class RankedPagination(BasePagination):
+    """
+    Offset pages over relevance ranked results, which have no stable key to
+    walk. Nobody reads deep into a ranking, so the offset is capped instead
+    of counting every match.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    offset_query_param = 'offset'
+    max_offset = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        # An empty page would link to itself as the next one
+        self.limit = self.get_int_param(self.page_size_query_param, self.page_size, 1, self.max_page_size)
+        self.offset = self.get_int_param(self.offset_query_param, 0, 0, self.max_offset)
+        # One extra row tells whether there is a next page
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit and self.offset + self.limit <= self.max_offset
+        return rows[:self.limit]
+
+    def get_int_param(self, name, default, minimum, maximum):
+        try:
+            value = int(self.request.query_params[name])
+        except (KeyError, ValueError):
+            return default
+        return min(max(value, minimum), maximum)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_previous_link(self):
+        if self.offset <= 0:
+            return None
+        url = self.request.build_absolute_uri()
+        offset = self.offset - self.limit
+        if offset <= 0:
+            return remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.offset_query_param, offset)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
@@ -61,6 +61,7 @@ DJANGO_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 ]
 
 THIRD_PARTY_APPS = [
@@ -74,19 +75,24 @@ THIRD_PARTY_APPS = [
 LOCAL_APPS = [
    'apps.user',
    'apps.book',
-   'apps.review'
+   'apps.review',
+   # Project wide management commands
+   'config',
 ]
 
 INSTALLED_APPS = DJANGO_APPS+LOCAL_APPS+THIRD_PARTY_APPS
 
 
 MIDDLEWARE = [
+    # First, so its timings cover the other middleware as well
+    'config.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'config.db_router.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -128,6 +134,29 @@ DATABASES = {
     }
 }
 
+# Read replicas, "host:port" pairs sharing the name and credentials of the primary.
+# Locally a single replica alias points at the primary itself, so the routing runs as in production.
+DB_REPLICA_HOSTS = env.list('DB_REPLICA_HOSTS', default=[f"{env('DB_HOST')}:{env('DB_PORT')}"] if DEBUG else [])
+for number, address in enumerate(DB_REPLICA_HOSTS, start=1):
+    host, _, port = address.partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        # Tests read the test database through the replica aliases
+        'TEST': {'MIRROR': 'default'},
+    }
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['config.db_router.ReplicaRouter']
+# A client reads from the primary for this long after a write, keep it above the replication lag
+REPLICA_STICKY_SECONDS = 10
+
+# Queries slower than this many seconds are logged with their plan, in a sample
+# of SLOW_QUERY_SAMPLE_RATE of them, keeping the last SLOW_QUERY_LOG_SIZE
+SLOW_QUERY_THRESHOLD = 0.5
+SLOW_QUERY_SAMPLE_RATE = 0.1
+SLOW_QUERY_LOG_SIZE = 200
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -175,19 +204,41 @@ EMAIL_PORT = 587
 EMAIL_HOST_USER=env('G_MAIL')
 EMAIL_HOST_PASSWORD =env('GMAIL_PASS')
 EMAIL_USE_TLS = True
+EMAIL_TIMEOUT = 30
 DEFAULT_FROM_EMAIL = env('G_MAIL')
 SITE_URL = env('SITE_URL')
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'apps.user.authentication.CachedTokenAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': [
+        'config.renderers.ORJSONRenderer',
+        'config.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.FormParser',
         'rest_framework.parsers.MultiPartParser',
-        'rest_framework.parsers.JSONParser',
+        'config.parsers.ORJSONParser',
+        'config.parsers.MessagePackParser',
     ],
-    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend']
+    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_PAGINATION_CLASS': 'config.pagination.CreatedAtCursorPagination',
+    'PAGE_SIZE': 50,
+    # Proxies in front of the app, the client address is read that many hops back in
+    # X-Forwarded-For. With none the header is ignored, a client could forge it.
+    'NUM_PROXIES': env.int('NUM_PROXIES', default=0),
+    # Token bucket rates of config.throttling, keyed "<view throttle_scope>_<ip|user|identifier>"
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': '30/min',
+        'login_identifier': '5/min',
+        'forgot_password_ip': '10/hour',
+        'forgot_password_identifier': '3/hour',
+        'register_ip': '10/hour',
+        'review_user': '30/min',
+        'favorite_user': '120/min',
+    },
 }
 
 CACHES = {
@@ -216,3 +267,12 @@ CELERY_RESULT_BACKEND = 'redis://localhost:6379'
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+# Seconds between two flushes of the mail outbox by celery beat, for the
+# emails whose flush could not be scheduled or ran out of retries
+MAIL_OUTBOX_SWEEP_INTERVAL = 60 * 5
+CELERYBEAT_SCHEDULE = {
+    'sweep-mail-outbox': {
+        'task': 'flush_mail_outbox',
+        'schedule': MAIL_OUTBOX_SWEEP_INTERVAL,
+    },
+}
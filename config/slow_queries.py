@@ -0,0 +1,95 @@
+import hashlib
+import random
+import re
+from datetime import datetime, timezone as dt_timezone
+
+import orjson
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from rest_framework.utils.encoders import JSONEncoder
+
+# Ring buffer of the latest slow queries, newest first. Staff only, the
+# parameters can hold personal data.
+SLOW_QUERIES_KEY = 'slow_queries'
+# The same statement is explained at most once in this many seconds
+EXPLAIN_COOLDOWN = 60
+# EXPLAIN ANALYZE runs the query again, give up on it after this long
+EXPLAIN_TIMEOUT_MS = 10000
+MAX_PARAMS_LENGTH = 2000
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+# Only reads are run again for ANALYZE, writes get the plan without running.
+# A WITH can hide a write in a data modifying CTE and a SELECT can take row locks.
+ANALYZABLE = ('SELECT', 'WITH')
+_writes = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE)\b|\bFOR\s+(KEY\s+)?SHARE\b', re.IGNORECASE)
+
+_encoder = JSONEncoder()
+
+
+def maybe_record(connection, sql, params, duration, request=None):
+    """
+    Called for each query slower than SLOW_QUERY_THRESHOLD. Keeps one in
+    SLOW_QUERY_SAMPLE_RATE of them, at most one per statement every
+    EXPLAIN_COOLDOWN seconds, with its plan and the request that ran it.
+    """
+    statement = sql.lstrip()[:6].upper()
+    if not statement.startswith(EXPLAINABLE) or random.random() >= settings.SLOW_QUERY_SAMPLE_RATE:
+        return
+    fingerprint = hashlib.sha1(sql.encode()).hexdigest()
+    if not cache.add(f'slow_query:{fingerprint}', 1, EXPLAIN_COOLDOWN):
+        return
+
+    match = getattr(request, 'resolver_match', None)
+    entry = {
+        'at': datetime.now(dt_timezone.utc),
+        'duration_ms': round(duration * 1000, 1),
+        'database': connection.alias,
+        'view': match.view_name if match else None,
+        'path': f'{request.method} {request.get_full_path()}' if request else None,
+        'sql': sql,
+        'params': repr(params)[:MAX_PARAMS_LENGTH],
+        'plan': explain(connection, sql, params, analyze=_is_read_only(statement, sql)),
+    }
+    pipeline = get_redis_connection('default').pipeline()
+    pipeline.lpush(SLOW_QUERIES_KEY, orjson.dumps(entry, default=_encoder.default))
+    pipeline.ltrim(SLOW_QUERIES_KEY, 0, settings.SLOW_QUERY_LOG_SIZE - 1)
+    pipeline.execute()
+
+
+def _is_read_only(statement, sql):
+    return statement.startswith(ANALYZABLE) and not _writes.search(sql)
+
+
+def explain(connection, sql, params, analyze=True):
+    """
+    Return the plan of a query as text. It runs on a raw cursor, so it skips
+    the execute wrappers and query logging, inside a transaction or savepoint
+    that is rolled back, so the ANALYZE run leaves no trace.
+    """
+    options = '(ANALYZE, BUFFERS)' if analyze else ''
+    in_transaction = not connection.get_autocommit()
+    with connection.connection.cursor() as cursor:
+        cursor.execute('SAVEPOINT slow_query_explain' if in_transaction else 'BEGIN')
+        try:
+            cursor.execute(f'SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}')
+            cursor.execute(f'EXPLAIN {options} {sql}', params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+        except connection.Database.Error as exc:
+            return f'EXPLAIN failed: {exc}'
+        finally:
+            if in_transaction:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            else:
+                cursor.execute('ROLLBACK')
+
+
+def get_slow_queries(limit=None):
+    end = -1 if limit is None else limit - 1
+    return [orjson.loads(entry) for entry in get_redis_connection('default').lrange(SLOW_QUERIES_KEY, 0, end)]
+
+
+def clear_slow_queries():
+    get_redis_connection('default').delete(SLOW_QUERIES_KEY)
@@ -1,8 +1,10 @@
+from django.core.cache import cache
 from django.test import override_settings
 
 from rest_framework.test import APITestCase,APIClient
 from rest_framework.authtoken.models import Token
 
+from apps.book.cache import local_cache
 from apps.user.tests.factories import UserFactory
 
 @override_settings(
@@ -16,6 +18,8 @@ class TestApi(APITestCase):
     def setUp(self):
         self.client = self.client_class()  # Instantiate the client
         super().setUp() 
+        cache.clear()  # Redis outlives the test database, drop entries of earlier tests
+        local_cache.clear()
         super_user = UserFactory(is_superuser=True, is_staff=True, password='password@123')
         user = UserFactory()
     
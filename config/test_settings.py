@@ -0,0 +1,12 @@
+from config.settings import *
+
+# Tests flush the cache before each case, keep them off the redis database of
+# the development server. The raw redis keys of the leaderboards, autocomplete
+# and mail outbox go through the same connection.
+CACHES = {
+    **CACHES,
+    'default': {
+        **CACHES['default'],
+        'LOCATION': 'redis://127.0.0.1:6379/15',
+    },
+}
@@ -0,0 +1,146 @@
+import logging
+import math
+from collections.abc import Mapping
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+# Token bucket refilled continuously at limit / period tokens per second.
+# Reading, refilling and taking a token happen in a single atomic round trip,
+# on the clock of redis so workers with skewed clocks agree on the refills.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill_rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill_rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+_token_bucket = None
+
+
+def _get_token_bucket():
+    global _token_bucket
+    if _token_bucket is None:
+        _token_bucket = get_redis_connection('default').register_script(TOKEN_BUCKET_SCRIPT)
+    return _token_bucket
+
+
+def parse_rate(rate):
+    # '5/min' -> (5, 60), same format as DRF's throttle rates
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class RedisRateThrottle(BaseThrottle):
+    """
+    Token bucket throttle kept in redis. The rate is looked up in
+    DEFAULT_THROTTLE_RATES under "<view.throttle_scope>_<suffix>", a view
+    without a rate for that key is not throttled by this class.
+    """
+    suffix = None
+
+    def get_ident_key(self, request, view):
+        raise NotImplementedError('get_ident_key() must be implemented')
+
+    def allow_request(self, request, view):
+        scope = f"{getattr(view, 'throttle_scope', None)}_{self.suffix}"
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        ident = self.get_ident_key(request, view)
+        if rate is None or ident is None:
+            return True
+
+        self.limit, period = parse_rate(rate)
+        self.refill_rate = self.limit / period
+        try:
+            allowed, tokens = _get_token_bucket()(
+                keys=[f'throttle:{scope}:{ident}'],
+                args=[self.limit, self.refill_rate],
+            )
+        except RedisError:
+            # Fail open, an unavailable redis must not lock everyone out
+            logger.exception('Rate limit check failed for %s', scope)
+            return True
+
+        self.tokens = float(tokens)
+        self.record_quota(request)
+        return bool(allowed)
+
+    def wait(self):
+        return (1 - self.tokens) / self.refill_rate
+
+    def record_quota(self, request):
+        # Keep the most restrictive quota for the X-RateLimit headers
+        remaining = math.floor(self.tokens)
+        reset = math.ceil((self.limit - self.tokens) / self.refill_rate)
+        current = getattr(request, 'rate_limit', None)
+        if current is None or remaining < current[1]:
+            request.rate_limit = (self.limit, remaining, reset)
+
+
+class IPRateThrottle(RedisRateThrottle):
+    suffix = 'ip'
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
+
+
+class UserRateThrottle(RedisRateThrottle):
+    suffix = 'user'
+
+    def get_ident_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return f'ip:{self.get_ident(request)}'
+
+
+class IdentifierRateThrottle(RedisRateThrottle):
+    """
+    Throttles by the account a request targets, e.g. the username of a login,
+    whichever address the attempts come from.
+    """
+    suffix = 'identifier'
+
+    def get_ident_key(self, request, view):
+        # JSON and msgpack bodies can be lists or scalars, those name no account
+        if not isinstance(request.data, Mapping):
+            return None
+        value = request.data.get(view.throttle_identifier_field)
+        if not isinstance(value, str) or not value:
+            return None
+        return value.strip().casefold()
+
+
+class RateLimitHeadersMixin:
+    """
+    Reports the remaining quota of the most restrictive throttle, on
+    throttled responses as well.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit:
+            limit, remaining, reset = rate_limit
+            response['X-RateLimit-Limit'] = limit
+            response['X-RateLimit-Remaining'] = remaining
+            response['X-RateLimit-Reset'] = reset
+        return response
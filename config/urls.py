@@ -22,6 +22,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from config.views import MetricsView, SlowQueriesView
+
 schema_view = get_schema_view(
    openapi.Info(
       title="Snippets API",
@@ -46,5 +48,7 @@ urlpatterns = [
     path('user/',include('apps.user.urls')),
     path('book/',include('apps.book.urls')),
     path('review/',include('apps.review.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('metrics/slow-queries/', SlowQueriesView.as_view(), name='slow-queries'),
 
 ]
@@ -0,0 +1,29 @@
+from django.http import HttpResponse
+
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from config.metrics import registry
+from config.slow_queries import get_slow_queries
+
+
+class MetricsView(APIView):
+    # Scraped with the token of a staff account
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class SlowQueriesView(APIView):
+    # The latest slow queries with their plans, newest first
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            limit = max(int(request.query_params.get('limit', 50)), 1)
+        except ValueError:
+            return Response({'msg': 'limit must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(get_slow_queries(limit))